@@ -1,6 +1,12 @@
+from __future__ import annotations
+import itertools
 import logging
-import multiprocessing as mp
-from typing import Optional, Tuple, Union, TypedDict
+import threading
+from concurrent.futures import Future, InvalidStateError
+from queue import Empty
+from typing import Any, Optional, Protocol, Tuple, Union, TypedDict
+
+from .latency import LATENCY
 
 #class XiParams(TypedDict):
 #    result: Optional[mp.Queue]
@@ -9,25 +15,156 @@ if TYPE_CHECKING:
     from .rpc import RpcController
 
 
+class Sink(Protocol):
+    """What is put on: a `queue.Queue` (single-process), a `mp.Queue` or manager queue (multi-process) or an AsyncViewChannel"""
+    def put(self, item: Any, /) -> None: ...
+
+
+class Channel(Sink, Protocol):
+    """A queue that is also read from (`queue.Queue`, `mp.Queue` or a manager queue)"""
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any: ...
+    def get_nowait(self) -> Any: ...
+
+
+class XiError(Exception):
+    """The error Xi replied to a call with (a dict with its code and message)"""
+
+
+def _resolve(future: Future, result: Any) -> None:
+    try:
+        future.set_result(result)
+    except InvalidStateError:  # cancelled (e.g. timed out), the result is dropped
+        logging.debug("[XiChannel] Dropping the result of a cancelled call: %.100r", result)
+
+
+def _fail(future: Future, error: Any) -> None:
+    try:
+        future.set_exception(XiError(error))
+    except InvalidStateError:
+        logging.debug("[XiChannel] Dropping the error of a cancelled call: %.100r", error)
+
+
+class Reply:
+    """The result "queue" of a `call` when the RpcController runs in this process: resolves the future directly.
+    `channel` receives the notifications of the view opened by a `new_view` call."""
+    def __init__(self, future: Future, channel: Optional[Sink] = None):
+        self.future = future
+        self.channel = channel
+
+    def put(self, result: Any) -> None:
+        _resolve(self.future, result)
+
+    def fail(self, error: Any) -> None:
+        _fail(self.future, error)
+
+
+class RemoteReply:
+    """The result "queue" of a `call` when the RpcController runs in another process (it's pickled):
+    the result (or error) is passed back, with the id of the call, on the replies queue of the XiChannel"""
+    # The replies queue is a mp.Queue (results are pickled once, and sent over a pipe), which can't be
+    # pickled along with the reply, so the backend process sets it here when it starts:
+    replies: Optional[Sink] = None
+
+    def __init__(self, call_id: int, channel: Optional[Sink] = None):
+        self.call_id = call_id
+        self.channel = channel
+
+    def put(self, result: Any) -> None:
+        assert self.replies is not None, "RemoteReply.replies isn't set in this process"
+        self.replies.put((self.call_id, result, None))
+
+    def fail(self, error: Any) -> None:
+        assert self.replies is not None, "RemoteReply.replies isn't set in this process"
+        self.replies.put((self.call_id, None, error))
+
+
+Result = Union[Reply, RemoteReply]
+
+
 class XiChannel:
-    def __init__(self, rpc_channel: mp.Queue):
+    MAX_BATCH = 1024  # max number of requests written to Xi in one flush
+
+    def __init__(self, rpc_channel: Channel, replies: Optional[Channel] = None):
+        """ `replies` is needed to `call` Xi when the RpcController runs in another process
+        (its results are dispatched to the futures by a thread, until None is put on it) """
         self._channel = rpc_channel
+        self._replies = replies
+        self._calls: dict[int, Future] = {}  # {call id: future} of the calls waiting for a remote reply
+        self._call_ids = itertools.count(1)
+        if replies is not None:
+            threading.Thread(target=self._dispatch_replies, daemon=True).start()
+
+    def __getstate__(self):
+        return {'_channel': self._channel}  # calls are only made, and resolved, in the process that created the channel
 
-    def put(self, method: str, params: dict = {}, result: Optional[mp.Queue] = None):
+    def __setstate__(self, state: dict):
+        XiChannel.__init__(self, state['_channel'])
+
+    def put(self, method: str, params: dict = {}, result: Optional[Result] = None):
         self._channel.put((method, params, result))
 
-    def edit(self, method: str, params: dict, view_id: str):
+    def put_many(self, requests: list[tuple[str, dict, Optional[Result]]]):
+        """ Put several requests on the channel at once (one item on the queue) """
+        self._channel.put(('batch', requests, None))
+
+    def call(self, method: str, params: dict = {}, channel: Optional[Sink] = None) -> Future:
+        """ Send a request, the returned future is resolved with its result (on a backend thread), or
+        fails with a XiError. Cancel the future to drop the result (e.g. after a timeout). `channel` receives the
+        notifications of the view opened by a `new_view` call.
+        """
+        future: Future = Future()
+        if self._replies is None:
+            self.put(method, params, result=Reply(future, channel))
+        else:
+            call_id = next(self._call_ids)
+            self._calls[call_id] = future
+            self.put(method, params, result=RemoteReply(call_id, channel))
+        return future
+
+    def _dispatch_replies(self) -> None:
+        assert self._replies is not None
+        while (reply := self._replies.get()) is not None:
+            (call_id, result, error) = reply
+            if error is None:
+                _resolve(self._calls.pop(call_id), result)
+            else:
+                _fail(self._calls.pop(call_id), error)
+
+    def edit(self, method: str, params: Union[dict, list], view_id: str):
         """ Helper for creating:
         {"method": "edit", "params": {"method": REAL_METHOD, "params": REAL_PARAMS}, "view_id": id}
         """
         req = {'method': method, 'params': params, 'view_id': view_id}
+        LATENCY.queued(view_id)
         self.put('edit', req)
 
     def process_requests(self, rpc: 'RpcController') -> None:
         while True:
-            (method, params, result) = self._channel.get()
-            if method == 'kill':
+            batch = self._get_batch()
+            kill = batch[-1][0] == 'kill'
+            if kill:
+                batch.pop()
+            if batch:
+                rpc.request_many(batch)
+            if kill:
                 logging.debug(f"process_requests Killing")
                 rpc.kill()
                 return
-            rpc.request(method, params, result)
+
+    def _get_batch(self) -> list[tuple[str, dict, Optional[Result]]]:
+        """Blocks until a request is ready, then drains all pending requests (up to and including a 'kill')"""
+        batch: list[tuple[str, dict, Optional[Result]]] = []
+        self._add_to_batch(batch, self._channel.get())
+        while batch[-1][0] != 'kill' and len(batch) < XiChannel.MAX_BATCH:
+            try:
+                self._add_to_batch(batch, self._channel.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _add_to_batch(batch: list, request: tuple) -> None:
+        if request[0] == 'batch':  # from put_many
+            batch.extend(request[1])
+        else:
+            batch.append(request)
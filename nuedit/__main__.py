@@ -1,22 +1,24 @@
-import logging
 import sys
 from multiprocessing import freeze_support
 # from gevent import monkey; monkey.patch_socket()
 
-from .keybinding import test_keybindings
-from .editor import editor
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename='/tmp/nuedit.log',
-    filemode='w',
-    format='[%(asctime)s] %(name)s - %(levelname)s - %(message)s')
+from . import log
+from .editor import MODES, editor
 
 
 if __name__ == '__main__':
     freeze_support()  # py2exe support, etc
+    log.setup()  # (not when imported by a spawned process, e.g. a find in files worker: it would truncate the log)
 
     if '--test' in sys.argv:
+        from .keybinding import test_keybindings
         test_keybindings()
+    elif '--bench' in sys.argv:  # e.g. --bench line_cache --json results.json
+        from .bench.__main__ import main
+        main([arg for arg in sys.argv[1:] if arg != '--bench'])
     else:
-        editor(sys.argv[1:])
+        files = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+        # --single-process (default), --multi-process or --asyncio:
+        modes = [mode for mode in MODES if f'--{mode}' in sys.argv]
+        editor(files, mode=modes[0] if modes else 'single-process',
+               profile_startup='--profile-startup' in sys.argv, profile_latency='--profile-latency' in sys.argv)
@@ -1,5 +1,5 @@
 from .copypaste import copy, cut, paste
-from .misc import find, new_view, close_view, next_view, previous_view
+from .misc import find, quick_open, new_view, close_view, next_view, previous_view
 from .multicursor import multicursor, multicursor_skip, multicursor_cancel
 
 __all__ = [
@@ -8,6 +8,7 @@ __all__ = [
     'paste',
 
     'find',
+    'quick_open',
     'new_view',
     'close_view',
     'next_view',
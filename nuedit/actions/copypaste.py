@@ -1,33 +1,118 @@
 import logging
+import threading
+from collections import deque
+from functools import partial
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Iterator
 
+from prompt_toolkit.selection import SelectionType
 # from prompt_toolkit.application.current import get_app
 
 from ..XiChannel import XiChannel
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from ..view import View
+    from ..view import View, SimpleView
 
+CALL_TIMEOUT = 5.0  # seconds to wait for the copied text (and for Xi to apply a chunk of a paste)
+PASTE_CHUNK = 256 * 1024  # max characters per edit, larger pastes are streamed (see StreamingPaste)
+PASTE_IN_FLIGHT = 2  # chunks sent to Xi before waiting for it to apply them
 
 def copy(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
-    result = view.manager.Queue()
     view_id = params.get('view_id') or view.current_view.view_id
     # For some reason params is a `[]` and we need result, so can't use .edit(...)
-    rpc_channel.put('edit', {'method': 'copy', 'params': [], 'view_id': view_id}, result=result)
-    view.app.clipboard.set_text(result.get() or "")
+    _to_clipboard(view, rpc_channel, {'method': 'copy', 'params': [], 'view_id': view_id})
 
 
 def cut(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
-    result = view.manager.Queue()
     view_id = params.get('view_id') or view.current_view.view_id
-    rpc_channel.put('edit', {'method': 'cut', 'params': [], 'view_id': view_id}, result=result)
-    view.app.clipboard.set_text(result.get() or "")
+    _to_clipboard(view, rpc_channel, {'method': 'cut', 'params': [], 'view_id': view_id})
+
+
+def _to_clipboard(view: 'View', rpc_channel: XiChannel, edit: dict) -> None:
+    # The UI doesn't wait for the text, a paste meanwhile waits for it (see below):
+    view.clipboard_future = rpc_channel.call('edit', edit)
+    view.when_done(view.clipboard_future, lambda text: view.app.clipboard.set_text(text or ""), timeout=CALL_TIMEOUT)
 
 
 def paste(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
-    text = view.app.clipboard.get_data()
     view_id = params.get('view_id') or view.current_view.view_id
-    if text.type == 'CHARACTERS':
-        rpc_channel.edit('paste', {'chars': text.text}, view_id)
-    else:
+    if view.clipboard_future is not None and not view.clipboard_future.done():
+        # Paste once the text of the previous copy/cut is on the clipboard (the current text if it timed out):
+        retry = partial(paste, {**params, 'view_id': view_id}, view, rpc_channel)
+        view.when_done(view.clipboard_future, lambda _: retry(), cancelled=retry)
+        return
+    text = view.app.clipboard.get_data()
+    if text.type != SelectionType.CHARACTERS:
         logging.warning(f"[ACTION] Can't paste {text.type=}")
+    elif len(text.text) > PASTE_CHUNK:
+        target = view.views[view_id]
+        if target.paste is None:
+            target.paste = StreamingPaste(view, rpc_channel, target, text.text)
+    else:
+        rpc_channel.edit('paste', {'chars': text.text}, view_id)
+
+
+def _chunks(text: str, size: int) -> Iterator[str]:
+    """ `text` in chunks of at most `size` characters, split after a line break when possible """
+    start = 0
+    while start < len(text):
+        end = start + size
+        if end < len(text) and (newline := text.rfind('\n', start, end)) > start:
+            end = newline + 1  # (keeps "\r\n" together)
+        yield text[start:end]
+        start = end
+
+
+class StreamingPaste:
+    """Pastes a large text into a view in chunks, from a background thread.
+
+    A single `paste` of megabytes is one giant JSON line (and pickled through the manager in
+    multi-process mode), which stalls the UI and Xi. Instead each chunk is sent as an `insert`
+    (Xi puts consecutive inserts in the same undo group, so the paste is undone at once), followed
+    by a `get_config` request: its result means Xi has applied the chunk, so at most PASTE_IN_FLIGHT
+    chunks are queued at a time. The view ignores key presses while pasting, except escape which
+    stops the paste. The Toolbar shows the progress.
+    """
+    def __init__(self, view: 'View', rpc_channel: XiChannel, target: 'SimpleView', text: str):
+        self.view = view
+        self.rpc_channel = rpc_channel
+        self.target = target
+        self.total = len(text)
+        self.applied = 0  # characters applied by Xi
+        self._cancelled = threading.Event()
+        logging.debug("[Paste] Streaming %d characters to %s", self.total, target.view_id)
+        threading.Thread(target=self._stream, args=(text, ), daemon=True).start()
+
+    @property
+    def progress(self) -> float:
+        return self.applied / self.total
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def _stream(self, text: str) -> None:
+        in_flight: deque[tuple[int, Future]] = deque()  # (characters, result of the get_config following them)
+        try:
+            for chunk in _chunks(text, PASTE_CHUNK):
+                if self._cancelled.is_set():
+                    logging.debug("[Paste] Stopped after %d of %d characters", self.applied, self.total)
+                    break
+                self.rpc_channel.edit('insert', {'chars': chunk}, self.target.view_id)
+                in_flight.append((len(chunk), self.rpc_channel.call('get_config', {'view_id': self.target.view_id})))
+                if len(in_flight) >= PASTE_IN_FLIGHT:
+                    self._wait(in_flight)
+            while in_flight:
+                self._wait(in_flight)
+        except FutureTimeoutError:
+            logging.warning("[Paste] Xi didn't apply a chunk in %ss, stopped after %d of %d characters",
+                            CALL_TIMEOUT, self.applied, self.total)
+        finally:
+            self.target.paste = None
+            self.view.app.invalidate()
+
+    def _wait(self, in_flight: deque[tuple[int, Future]]) -> None:
+        (n, applied) = in_flight.popleft()
+        applied.result(CALL_TIMEOUT)
+        self.applied += n
+        self.view.app.invalidate()  # shows the progress
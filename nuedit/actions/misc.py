@@ -1,5 +1,4 @@
 from ..XiChannel import XiChannel
-from ..menu import SearchToolbar
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -7,10 +6,17 @@ if TYPE_CHECKING:
 
 
 def find(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
+    from ..menu import SearchToolbar
     view.toolbar = SearchToolbar(view)
     view.app.layout.focus(view.toolbar)
 
 
+def quick_open(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
+    from ..menu import QuickOpenToolbar
+    view.toolbar = QuickOpenToolbar(view)
+    view.app.layout.focus(view.toolbar)
+
+
 def new_view(params: dict, view: 'View', rpc_channel: XiChannel) -> None:
     view.fileman_visible = True
     view.app.layout.focus(view.fileman)
@@ -0,0 +1,120 @@
+"""Optional asyncio transport: Xi runs as a subprocess of the prompt_toolkit event loop.
+
+Requests are written, and notifications are dispatched to the views, directly on the event
+loop, so there is no backend process, no manager queues and no worker threads between a key
+press and the redraw. Select it with `python -m nuedit --asyncio`.
+"""
+import asyncio
+import logging
+from asyncio.subprocess import DEVNULL, PIPE
+from time import monotonic
+from typing import Any, Optional
+
+from .coalesce import CoalescingChannel
+from .log import TRACE
+from .rpc import RpcController, core_command
+from .state import State
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .view import SimpleView
+
+MAX_LINE = 1 << 30  # max length of a line from Xi (asyncio's default is 64 KiB, less than a big update)
+
+
+class AsyncRpc(RpcController):
+    """RpcController writing to, and reading from, Xi on the event loop"""
+    def __init__(self, state: State):
+        self._setup(state)
+        self.process: Optional[asyncio.subprocess.Process] = None  # Xi-core
+        self.reader: Optional[asyncio.Task] = None
+
+    async def start(self, core_cmd: Optional[list[str]] = None) -> None:
+        self.process = await asyncio.create_subprocess_exec(*(core_cmd or core_command(self.state.settings)), stdin=PIPE, stdout=PIPE, stderr=DEVNULL, limit=MAX_LINE)
+        self.send_raw_dict({"method": "client_started", "params": {}})
+        self.reader = asyncio.create_task(self._read())
+
+    async def stop(self) -> None:
+        assert self.process is not None and self.process.stdin is not None and self.reader is not None
+        self.process.stdin.close()
+        await self.process.wait()
+        if self.process.returncode != 0:
+            logging.warning("[RPC] Xi-core exited with exit code %s", self.process.returncode)
+        await self.reader
+
+    def _write(self, data: bytes) -> None:
+        assert self.process is not None and self.process.stdin is not None
+        self.process.stdin.write(data)  # written by the event loop as soon as possible (no flush needed)
+
+    async def _read(self) -> None:
+        assert self.process is not None and self.process.stdout is not None
+        while raw := await self.process.stdout.readline():
+            TRACE.record('<', raw)
+            logging.debug("[RPC] Receiving: %s", raw)
+            self.handle(self.codec.loads(raw))
+
+
+class _Direct:
+    """Stands in for the queue of a XiChannel: requests are sent to Xi right away"""
+    def __init__(self, rpc: AsyncRpc, loop: asyncio.AbstractEventLoop):
+        self.rpc = rpc
+        self.loop = loop
+
+    def put(self, request: tuple[str, Any, Any]) -> None:
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if not on_loop:  # the transport can only be used from the event loop
+            self.loop.call_soon_threadsafe(self.put, request)
+            return
+        (method, params, result) = request
+        if method == 'batch':  # from put_many
+            self.rpc.request_many(params)
+        else:
+            self.rpc.request(method, params, result)
+
+
+class AsyncXiChannel(CoalescingChannel):
+    """The rpc channel of the UI when using the asyncio transport (must be created on the event loop)"""
+    def __init__(self, rpc: AsyncRpc, max_fps: int = 60):
+        # Results of `call`s are put by the RpcController on the event loop, so the futures are resolved there:
+        super().__init__(_Direct(rpc, asyncio.get_running_loop()), max_fps)  # type: ignore
+
+
+class AsyncViewChannel:
+    """The view channel of a SimpleView when using the asyncio transport.
+
+    Messages are dispatched to the attached view on the event loop (held back until attached),
+    and the view is drawn at most once per frame.
+    """
+    def __init__(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.view: Optional['SimpleView'] = None
+        self._held: list[tuple[str, dict]] = []
+        self._frame: Optional[asyncio.TimerHandle] = None
+        self._next_frame = 0.0
+
+    def attach(self, view: 'SimpleView') -> None:
+        self.view = view
+        for msg in self._held:
+            self.put(msg)
+        self._held.clear()
+
+    def put(self, msg: Any) -> None:
+        if msg[0] == 'kill':
+            self.view = None
+            if self._frame is not None:
+                self._frame.cancel()
+        elif self.view is None:
+            self._held.append(msg)
+        else:
+            self.view.dispatch(*msg)
+            if self.view.needs_render and self._frame is None:
+                self._frame = self.loop.call_later(max(0.0, self._next_frame - monotonic()), self._draw)
+
+    def _draw(self) -> None:
+        self._frame = None
+        if self.view is not None:
+            self.view.draw_frame()
+            self._next_frame = monotonic() + 1 / self.view.max_fps
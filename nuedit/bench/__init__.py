@@ -0,0 +1,29 @@
+"""Micro-benchmarks for the hot paths of NuEdit.
+
+Run a single benchmark with e.g. `python -m nuedit.bench.state`
+"""
+import sys
+from time import perf_counter
+from typing import Callable
+
+# Stands in for xi-core (run from the root of the repo), see `nuedit.fake_core` for its options
+FAKE_CORE = [sys.executable, '-m', 'nuedit.fake_core']
+
+
+def timeit(fn: Callable[[], object], n: int, repeat: int = 5) -> float:
+    """ Returns the mean time (in seconds) of calling `fn()` `n` times (best of `repeat` runs) """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, perf_counter() - start)
+    return best / n
+
+
+def report(title: str, results: dict[str, float], unit: str = 'us') -> None:
+    """ Print `results` ({case: seconds}) as a table. Values are printed as-is unless `unit` is 'us' """
+    print(title)
+    width = max(map(len, results))
+    for case, value in results.items():
+        print(f"  {case.ljust(width)}  {value * 1e6 if unit == 'us' else value:12.2f} {unit}")
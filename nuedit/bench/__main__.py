@@ -0,0 +1,45 @@
+"""Run all (or the given) benchmarks and optionally write the results as JSON
+
+    python -m nuedit.bench [name ...] [--json results.json]
+
+(or `python -m nuedit --bench ...`). Run from the root of the repo (the benchmarks read settings.yaml).
+Compare the JSON of two runs to spot regressions on the hot paths.
+"""
+import argparse
+import importlib
+import json
+import platform
+import sys
+from time import time
+
+from . import report
+
+BENCHMARKS = ['line_cache', 'spans', 'quick_open', 'codec', 'state', 'writer', 'transport', 'call', 'startup', 'find_in_files']
+SLOW = {'find_in_files'}  # only run when named (it generates a 10 GB tree)
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog='python -m nuedit.bench', description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*', metavar='name', help=f"default: all but {', '.join(SLOW)} ({', '.join(BENCHMARKS)})")
+    parser.add_argument('--json', metavar='PATH', help="write the results to PATH")
+    args = parser.parse_args(argv)
+    if unknown := set(args.names) - set(BENCHMARKS):
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    results = {}
+    for name in args.names or [name for name in BENCHMARKS if name not in SLOW]:
+        bench = importlib.import_module(f'.{name}', __package__)
+        unit = getattr(bench, 'UNIT', 'us')
+        values = bench.run()
+        report(bench.TITLE, values, unit)
+        # Values are saved as returned by `run()`, i.e. in seconds when printed in us:
+        results[name] = {'title': bench.TITLE, 'unit': 's' if unit == 'us' else unit, 'results': values}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'time': time(), 'python': platform.python_version(), 'platform': platform.platform(),
+                       'benchmarks': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,66 @@
+"""Round-trip of a request with a result (`copy`): a fresh result queue per request vs. XiChannel.call
+
+Before XiChannel.call, every request waiting for a result created its own queue, which in
+multi-process mode is a round-trip to the manager process before the request is even sent.
+"""
+import asyncio
+from time import perf_counter
+from typing import Any
+
+from . import FAKE_CORE, report
+from ..XiChannel import XiChannel
+from ..aio import AsyncRpc, AsyncViewChannel, AsyncXiChannel
+from ..editor import multi_process_backend, single_process_backend
+from ..state import State
+
+N = 1_000
+CORE = FAKE_CORE + ['--lines', '1']
+TITLE = f"Request/result round-trip (mean of {N})"
+COPY: dict[str, Any] = {'method': 'copy', 'params': [], 'view_id': None}
+
+
+def bench_backend(start_backend) -> dict[str, float]:
+    with start_backend({}, CORE) as backend:
+        rpc_channel = XiChannel(backend.rpc_queue, backend.replies)
+        view_id = rpc_channel.call('new_view', {}, channel=backend.new_queue()).result()
+        copy = {**COPY, 'view_id': view_id}
+
+        start = perf_counter()
+        for _ in range(N):
+            result = backend.new_queue()
+            rpc_channel.put('edit', copy, result=result)  # type: ignore
+            result.get()
+        queue_per_request = (perf_counter() - start) / N
+
+        start = perf_counter()
+        for _ in range(N):
+            rpc_channel.call('edit', copy).result()
+        call = (perf_counter() - start) / N
+    return {'queue per request': queue_per_request, 'call': call}
+
+
+async def _bench_asyncio() -> float:
+    rpc = AsyncRpc(State({}, {}))
+    await rpc.start(CORE)
+    channel = AsyncXiChannel(rpc)
+    view_id = await asyncio.wrap_future(channel.call('new_view', {}, channel=AsyncViewChannel()))  # type: ignore
+    copy = {**COPY, 'view_id': view_id}
+    start = perf_counter()
+    for _ in range(N):
+        await asyncio.wrap_future(channel.call('edit', copy))
+    elapsed = perf_counter() - start
+    await rpc.stop()
+    return elapsed / N
+
+
+def run() -> dict[str, float]:
+    results = {}
+    for (name, start_backend) in [('single-process', single_process_backend), ('multi-process', multi_process_backend)]:
+        for (case, value) in bench_backend(start_backend).items():
+            results[f"{name}, {case}"] = value
+    results['asyncio, call'] = asyncio.run(_bench_asyncio())
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
@@ -0,0 +1,37 @@
+"""Decoding `update` notifications (as received from Xi) of increasing size with each installed codec"""
+import json
+
+from . import timeit, report
+from ..codec import CODECS, get_codec
+
+SIZES = [10, 100, 1_000, 10_000]
+TITLE = "Decode update notification"
+
+
+def update_payload(n_lines: int, line_len: int = 80) -> bytes:
+    """ A recorded-style `update` notification inserting `n_lines` styled lines """
+    text = ('lorem ipsum dolor sit amet ' * (line_len // 27 + 1))[:line_len] + '\n'
+    return json.dumps({'method': 'update', 'params': {'view_id': 'view-id-1', 'update': {
+        'annotations': [{'type': 'selection', 'ranges': [[0, 0, 0, 0]], 'payloads': None, 'n': 1}],
+        'pristine': True,
+        'ops': [{'op': 'ins', 'n': n_lines, 'lines': [
+            {'text': text, 'ln': ln + 1, 'cursor': [0] if ln == 0 else [], 'styles': [0, 5, 2, 7, 5, 3]}
+            for ln in range(n_lines)
+        ]}],
+    }}}).encode() + b'\n'
+
+
+def run() -> dict[str, float]:
+    results = {}
+    for name in CODECS:
+        codec = get_codec(name)
+        if codec.name != name:
+            continue  # not installed
+        for n_lines in SIZES:
+            payload = update_payload(n_lines)
+            results[f'{name} {n_lines} lines'] = timeit(lambda: codec.loads(payload), max(10, 10_000 // n_lines))
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
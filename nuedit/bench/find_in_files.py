@@ -0,0 +1,76 @@
+"""Find in files: searching a synthetic tree (10 GB by default) with 1, 2, 4... workers (time to the first hit and to the end)
+
+The tree is generated once (in the temp dir) and reused, set its size with `$NUEDIT_BENCH_FIND_GB`, e.g.
+`NUEDIT_BENCH_FIND_GB=0.5 python -m nuedit.bench.find_in_files`. Once the tree doesn't fit the page cache the
+search is bound by the disk rather than the number of workers.
+"""
+import os
+import random
+import tempfile
+from pathlib import Path
+from time import perf_counter, sleep
+
+from . import report
+from .quick_open import WORDS
+from ..file_index import FileIndex
+from ..find_in_files import FindInFiles
+
+FILE_SIZE = 1 << 20
+QUERY = 'needle'  # in every 10th file
+TITLE = "Find in files"
+UNIT = 's'
+
+
+def synthetic_tree(gb: float) -> Path:
+    """ A tree of `gb` GB of 1 MB text files (every 50th is binary), generated once """
+    root = Path(tempfile.gettempdir()) / f"nuedit-bench-find-{gb:g}gb"
+    done = root.parent / f"{root.name}.done"
+    if done.exists():
+        return root
+    rnd = random.Random(1)
+    lines = [' '.join(rnd.choices(WORDS, k=rnd.randint(0, 12))).encode() + b'\n' for _ in range(4096)]
+    blocks = [b''.join(rnd.choices(lines, k=1024)) for _ in range(16)]
+    for i in range(int(gb * (1 << 30)) // FILE_SIZE):
+        path = root / f"dir{i % 100}" / f"file{i}.{'bin' if i % 50 == 0 else 'txt'}"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = bytearray(b'\0' if i % 50 == 0 else b'')
+        while len(data) < FILE_SIZE:
+            data += rnd.choice(blocks)
+        if i % 10 == 0:
+            data[FILE_SIZE // 2:FILE_SIZE // 2] = b'the needle\n'
+        path.write_bytes(data[:FILE_SIZE])
+    done.touch()
+    return root
+
+
+def search(index: FileIndex, workers: int) -> tuple[float, float]:
+    """ (time to the first hit, time to the end) of searching the tree """
+    published: list[float] = []
+    start = perf_counter()
+    finder = FindInFiles(index, QUERY, on_results=lambda: published.append(perf_counter()), workers=workers)
+    while not finder.done:
+        sleep(0.001)
+    end = perf_counter()
+    return (published[0] - start, end - start)
+
+
+def run() -> dict[str, float]:
+    gb = float(os.environ.get('NUEDIT_BENCH_FIND_GB', 10))
+    with tempfile.TemporaryDirectory() as cache_dir:
+        index = FileIndex(synthetic_tree(gb), cache_dir=Path(cache_dir))
+        while not index.done:
+            sleep(0.01)
+    results = {}
+    (workers, cpus) = (1, os.cpu_count() or 1)
+    while True:
+        (first, end) = search(index, workers)
+        results[f"{gb:g} GB  {workers:>3} workers  first hit"] = first
+        results[f"{gb:g} GB  {workers:>3} workers  done"] = end
+        if workers >= cpus:
+            break
+        workers = min(2 * workers, cpus)
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run(), UNIT)
@@ -0,0 +1,106 @@
+"""Applying and rendering `update`s on documents of increasing size
+
+The updates are generated by the fake core (`nuedit.fake_core`) for a view of `HEIGHT` lines:
+ * open: the first update (the visible lines are inserted, the rest is invalid)
+ * move: the cursor moves down a line (update + copy ops)
+ * edit: a character is inserted (copy + ins + skip ops)
+ * scroll: the view scrolls to the middle of the document (invalidate + ins ops)
+
+Each update is applied to the state after `open`, by `LineCache.apply_update` and the legacy `Lines.apply`.
+`rpc_update + render` also renders the visible lines of a `SimpleView`, and `get_style_text_pairs`
+renders them without the fragment cache.
+"""
+import queue
+from typing import Callable
+
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+from yaml import safe_load
+
+from . import timeit, report
+from ..coalesce import CoalescingChannel
+from ..fake_core import N_STYLES, Document, View
+from ..line import Lines
+from ..state import DEFAULT_STYLES, State
+from ..view import GlobalView, SimpleView
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+HEIGHT = 50
+N = 200  # runs per case (fewer for the legacy `Lines`, which is O(document length))
+TITLE = f"Apply (and render) an update of a {HEIGHT} line view (per update)"
+
+
+def updates(size: int) -> dict[str, dict]:
+    """ The updates sent by the fake core when opening a document of `size` lines, and then moving, editing or scrolling """
+    out: list[dict] = []
+    view = View('view-id-1', Document(size, 80), styles=4, annotations=size // 100, height=HEIGHT, out=out.append)
+    view.update()
+    result = {'open': out[0]['params']['update']}
+    for (case, method, params) in [('move', 'move_down', {}), ('edit', 'insert', {'chars': 'x'}),
+                                   ('scroll', 'scroll', [size // 2, size // 2 + HEIGHT])]:
+        view.sent = (0, HEIGHT)  # every case starts from the state after `open`
+        out.clear()
+        view.edit(method, params)
+        result[case] = next(msg['params']['update'] for msg in out if msg['method'] == 'update')
+    return result
+
+
+def key(name: str, case: str, size: int) -> str:
+    return f"{name} {case}".ljust(32) + f"{size:>10,} lines"
+
+
+def bench_line_cache(sview: SimpleView, size: int, results: dict[str, float]) -> None:
+    cases = updates(size)
+    cache = sview.line_cache
+    cache.apply_update(cases['open'])
+    base = (cache.runs, cache._offsets, cache._len, cache.max_ln)
+
+    def reset() -> None:
+        (cache.runs, cache._offsets, cache._len, cache.max_ln) = base
+
+    def apply(update: dict) -> Callable[[], None]:
+        def fn() -> None:
+            reset()
+            cache.apply_update(update)
+        return fn
+
+    for (case, update) in cases.items():
+        results[key("LineCache.apply_update", case, size)] = timeit(apply(update), N)
+
+    def rpc_update_render() -> None:
+        reset()
+        sview.rpc_update(cases['edit'])
+        sview.render()
+    results[key("rpc_update + render", 'edit', size)] = timeit(rpc_update_render, N)
+
+    visible = [line for line in cache.visible(0, HEIGHT) if line]
+    results[key("get_style_text_pairs", 'visible', size)] = timeit(
+        lambda: [line.get_style_text_pairs(cache.annotation_index, cache.styles) for line in visible], N)
+
+    legacy = Lines(cache.styles).apply(cases['open'])
+    n = max(1, N * 1_000 // size)
+    for case in ('open', 'edit', 'scroll'):  # `Lines.apply` drops the lines of `update` ops
+        results[key("Lines.apply (legacy)", case, size)] = timeit(lambda: legacy.apply(cases[case]), n)
+
+
+def run() -> dict[str, float]:
+    results: dict[str, float] = {}
+    with create_pipe_input() as inp, create_app_session(input=inp, output=DummyOutput()):
+        with open('settings.yaml') as f:
+            settings = safe_load(f)
+        styles: dict[str|int, str] = {**DEFAULT_STYLES, **{i: 'fg:#ff0000 italic' for i in range(2, 2 + N_STYLES)}}  # as defined by the fake core
+        state = State(settings, styles)
+        v = GlobalView(queue.Queue, state, CoalescingChannel(queue.Queue()))
+        for size in SIZES:
+            channel: queue.Queue = queue.Queue()
+            sview = SimpleView(None, channel, 'view-id-1', v)  # type: ignore
+            channel.put(('kill', {}))  # updates are applied by the benchmark, not by _bg_worker
+            sview.thread.join()  # type: ignore
+            sview.height = HEIGHT
+            bench_line_cache(sview, size, results)
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
@@ -0,0 +1,52 @@
+"""Quick-open: fuzzy matching synthetic project trees of 100k and 1M paths (time to the first results and to the end)"""
+import random
+import types
+from time import perf_counter, sleep
+
+from . import report
+from ..file_index import FuzzyMatcher
+
+SIZES = [100_000, 1_000_000]
+QUERIES = ['e', 'ed', 'edit', 'editor', 'zzq']  # typed one character at a time, 'zzq' matches nothing
+TITLE = "Quick-open fuzzy matching"
+UNIT = 'ms'
+WORDS = ['src', 'lib', 'test', 'core', 'util', 'view', 'model', 'editor', 'render', 'cache', 'index', 'parser',
+         'net', 'http', 'json', 'io', 'fs', 'app', 'main', 'config', 'build', 'docs', 'api', 'ui', 'line', 'buffer']
+
+
+def synthetic_paths(n: int) -> list[str]:
+    rnd = random.Random(1)
+    return [
+        f"{'/'.join(rnd.choices(WORDS, k=rnd.randint(1, 5)))}/{rnd.choice(WORDS)}_{rnd.choice(WORDS)}{i % 977}"
+        f".{rnd.choice(['py', 'rs', 'js', 'md', 'c', 'h'])}"
+        for i in range(n)
+    ]
+
+
+def search(matcher: FuzzyMatcher, query: str) -> tuple[float, float]:
+    """ (time to the first results, time to the end) of searching `query` """
+    published: list[float] = []
+    matcher.on_results = lambda: published.append(perf_counter())
+    start = perf_counter()
+    matcher.search(query)
+    while not matcher.done:
+        sleep(0.0002)
+    end = perf_counter()
+    return (published[0] - start, end - start)
+
+
+def run() -> dict[str, float]:
+    results = {}
+    for size in SIZES:
+        index = types.SimpleNamespace(paths=synthetic_paths(size), done=True)
+        matcher = FuzzyMatcher(index)  # type: ignore  # (only its paths and done are read)
+        for query in QUERIES:
+            (first, end) = search(matcher, query)
+            results[f"{size:>9,} paths  {query!r:8} first"] = first * 1e3
+            results[f"{size:>9,} paths  {query!r:8} done"] = end * 1e3
+        matcher.close()
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run(), UNIT)
@@ -0,0 +1,49 @@
+"""Rendering one 200 column line: per character (style, char) tuples vs. merged spans"""
+from . import timeit, report
+from ..line_cache import SingleLine
+from ..spans import AnnotationIndex, FragmentCache
+from ..state import DEFAULT_STYLES
+
+N = 1_000
+STYLES = {**DEFAULT_STYLES, 2: 'fg:#ff0000', 3: 'italic'}
+TITLE = "Render one line (per line)"
+
+
+def per_character_pairs(line: SingleLine, styles: dict) -> list[tuple[str, str]]:
+    """The previous implementation: one (style, char) tuple per character"""
+    per_char = {}
+    last_end = 0
+    for i in range(0, len(line.styles), 3):
+        start_idx = line.styles[i] + last_end
+        last_end = start_idx + line.styles[i + 1]
+        for j in range(start_idx, last_end):
+            per_char[j] = styles[line.styles[i + 2]]
+    for cursor in line.cursor:
+        per_char[cursor] = styles['cursor']
+    return [(per_char.get(i, ''), c) for i, c in enumerate(line.text)]
+
+
+def sample_line(n_styles: int = 10) -> SingleLine:
+    return SingleLine(
+        text=('def some_function(argument): return argument + 1  # ' * 4)[:200] + '\n',
+        ln=1,
+        cursor=[42],
+        styles=[x for i in range(n_styles) for x in (5, 8, 2 + i % 2)],
+    )
+
+
+def run() -> dict[str, float]:
+    line = sample_line()
+    cache = FragmentCache()
+    annotations = AnnotationIndex([{'type': 'find', 'ranges': [[0, 20, 0, 30]], 'payloads': None, 'n': 1}])
+    # The number of fragments is part of the case, e.g. "spans (15 fragments)":
+    (per_character, spans) = (len(per_character_pairs(line, STYLES)), len(line.get_style_text_pairs(annotations, STYLES)))
+    return {
+        f'per character ({per_character} fragments)': timeit(lambda: per_character_pairs(line, STYLES), N),
+        f'spans ({spans} fragments)': timeit(lambda: line.get_style_text_pairs(annotations, STYLES), N),
+        f'spans, cached ({spans} fragments)': timeit(lambda: line.get_style_text_pairs(annotations, STYLES, cache), N),
+    }
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
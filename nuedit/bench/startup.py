@@ -0,0 +1,73 @@
+"""Startup time of each mode: from starting the backend until the first update of a file is applied
+
+Xi-core is replaced by the fake core (see `FAKE_CORE`), and the time to import NuEdit isn't included.
+"""
+import asyncio
+from time import perf_counter, sleep
+
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+from yaml import safe_load
+
+from . import FAKE_CORE, report
+from ..aio import AsyncRpc, AsyncXiChannel
+from ..coalesce import CoalescingChannel
+from ..editor import multi_process_backend, single_process_backend
+from ..state import DEFAULT_STYLES, State
+from ..view import GlobalView
+
+REPEAT = 5
+FILE = 'README.md'
+TITLE = f"Startup until {FILE} is loaded (best of {REPEAT})"
+UNIT = 'ms'
+
+
+def bench_backend(start_backend, settings: dict) -> float:
+    start = perf_counter()
+    with start_backend(settings, FAKE_CORE) as backend:
+        v = GlobalView(backend.new_queue, backend.state, CoalescingChannel(backend.rpc_queue, replies=backend.replies))
+        v.new_view(FILE)
+        while v.current_view.is_dirty is None:  # type: ignore
+            sleep(.0005)
+        elapsed = perf_counter() - start
+
+        v.fileman_visible = True  # don't exit the (not running) app
+        v.close_view(v.focused_view)  # type: ignore
+        v.rpc_channel.flush()
+    return elapsed
+
+
+async def _bench_asyncio(settings: dict) -> float:
+    start = perf_counter()
+    rpc = AsyncRpc(State(settings, dict(DEFAULT_STYLES)))
+    await rpc.start(FAKE_CORE)
+    v = GlobalView(None, rpc.state, AsyncXiChannel(rpc))
+    v.new_view(FILE)
+    while v.current_view is None or v.current_view.is_dirty is None:
+        await asyncio.sleep(.0005)
+    elapsed = perf_counter() - start
+
+    v.fileman_visible = True
+    v.close_view(v.focused_view)  # type: ignore
+    v.rpc_channel.flush()
+    await rpc.stop()
+    return elapsed
+
+
+def run() -> dict[str, float]:
+    with open('settings.yaml') as f:
+        settings = safe_load(f)
+    results = {}
+    with create_pipe_input() as inp, create_app_session(input=inp, output=DummyOutput()):
+        for (mode, startup) in [
+            ('single-process', lambda: bench_backend(single_process_backend, settings)),
+            ('multi-process', lambda: bench_backend(multi_process_backend, settings)),
+            ('asyncio', lambda: asyncio.run(_bench_asyncio(settings))),
+        ]:
+            results[mode] = min(startup() for _ in range(REPEAT)) * 1e3
+    return results
+
+
+if __name__ == '__main__':
+    report(TITLE, run(), UNIT)
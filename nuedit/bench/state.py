@@ -0,0 +1,57 @@
+"""Keypress dispatch: DictProxy shared_state (manager round-trips) vs. the local `State` replica
+
+Every keypress evaluates the `Condition` filter of `get_view_kb` (`view.current_view is not None`),
+looks up the key binding, finds the focused view and (in the backend) checks that the view has a channel.
+"""
+import multiprocessing as mp
+
+from . import timeit, report
+from ..state import DEFAULT_STYLES, State
+
+N = 2_000
+SETTINGS = {'keybindings': {'down': 'move_down'}}
+VIEWS = {'view-id-1': object()}
+TITLE = "Keypress dispatch (per key)"
+
+
+def bench_proxy(manager) -> float:
+    shared_state = manager.dict({
+        'settings': manager.dict(SETTINGS),
+        'styles': manager.dict(DEFAULT_STYLES),
+        'view_channels': manager.dict({'view-id-1': None}),
+        'focused_view': 'view-id-1',
+    })
+    kb_map = shared_state['settings']['keybindings']
+
+    def keypress():
+        if VIEWS.get(shared_state['focused_view']) is not None:  # Condition filter
+            assert kb_map['down']
+            view_id = 'view-id-1' if VIEWS.get(shared_state['focused_view']) else None
+            assert view_id in shared_state['view_channels']
+
+    return timeit(keypress, N)
+
+
+def bench_local() -> float:
+    state = State(SETTINGS, dict(DEFAULT_STYLES))
+    focused_view = 'view-id-1'
+    view_channels = {'view-id-1': None}
+    kb_map = state.settings['keybindings']
+
+    def keypress():
+        if VIEWS.get(focused_view) is not None:  # Condition filter
+            assert kb_map['down']
+            view_id = 'view-id-1' if VIEWS.get(focused_view) else None
+            assert view_id in view_channels
+
+    return timeit(keypress, N)
+
+
+def run() -> dict[str, float]:
+    with mp.Manager() as manager:
+        proxy = bench_proxy(manager)
+    return {'DictProxy shared_state': proxy, 'local State': bench_local()}
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
@@ -0,0 +1,71 @@
+"""Round-trip latency of an edit: from sending a key press to its `update` arriving at the view
+
+Compares the transports: single-process (plain queues and threads), multi-process (manager
+queues, backend process and threads) and asyncio (everything on the event loop). Xi-core is
+replaced by the fake core with a one line document, so this mostly measures our side of the pipe.
+"""
+import asyncio
+from time import perf_counter
+
+from . import FAKE_CORE, report
+from ..XiChannel import XiChannel
+from ..aio import AsyncRpc, AsyncXiChannel
+from ..editor import multi_process_backend, single_process_backend
+from ..state import State
+
+N = 2_000
+CORE = FAKE_CORE + ['--lines', '1']
+TITLE = f"Edit round-trip (mean of {N})"
+
+
+def bench_backend(start_backend) -> float:
+    with start_backend({}, CORE) as backend:
+        rpc_channel = XiChannel(backend.rpc_queue, backend.replies)
+        view_channel = backend.new_queue()
+        view_id = rpc_channel.call('new_view', {}, channel=view_channel).result()
+        while view_channel.get()[0] != 'update':  # the initial update
+            pass
+        start = perf_counter()
+        for _ in range(N):
+            rpc_channel.edit('insert', {'chars': 'x'}, view_id)
+            while view_channel.get()[0] != 'update':  # skips the `scroll_to` of the previous edit
+                pass
+        return (perf_counter() - start) / N
+
+
+class _Sink(asyncio.Queue):
+    """View channel (msgs are put by the RpcController on the event loop)"""
+    def put(self, msg) -> None:  # type: ignore
+        self.put_nowait(msg)
+
+
+async def _bench_asyncio() -> float:
+    rpc = AsyncRpc(State({}, {}))
+    await rpc.start(CORE)
+    channel = AsyncXiChannel(rpc)
+
+    sink = _Sink()
+    view_id = await asyncio.wrap_future(channel.call('new_view', {}, channel=sink))  # type: ignore
+    while (await sink.get())[0] != 'update':  # the initial update
+        pass
+    start = perf_counter()
+    for _ in range(N):
+        channel.edit('insert', {'chars': 'x'}, view_id)
+        while (await sink.get())[0] != 'update':
+            pass
+    elapsed = perf_counter() - start
+
+    await rpc.stop()
+    return elapsed / N
+
+
+def run() -> dict[str, float]:
+    return {
+        'single-process': bench_backend(single_process_backend),
+        'multi-process': bench_backend(multi_process_backend),
+        'asyncio': asyncio.run(_bench_asyncio()),
+    }
+
+
+if __name__ == '__main__':
+    report(TITLE, run())
@@ -0,0 +1,50 @@
+"""Throughput of requests written to Xi: one flush per message vs. batched flushes
+
+Xi-core is replaced by a process that discards its stdin, so this only measures our side of the pipe.
+"""
+import queue
+import threading
+from time import perf_counter
+
+from . import report
+from ..XiChannel import XiChannel
+from ..rpc import RpcController
+from ..state import State
+
+N = 20_000
+SINK = ['sh', '-c', 'cat > /dev/null']
+TITLE = f"Writes to Xi ({N} edits)"
+UNIT = 'msg/s'
+
+
+def _edit() -> tuple[str, dict, None]:
+    return ('edit', {'method': 'insert', 'params': {'chars': 'x'}, 'view_id': 'view-id-1'}, None)
+
+
+def bench_unbatched() -> float:
+    rpc = RpcController(State({}, {}), threading.Event(), core_cmd=SINK)
+    start = perf_counter()
+    for _ in range(N):
+        rpc.request(*_edit())
+    elapsed = perf_counter() - start
+    rpc.kill()
+    return N / elapsed
+
+
+def bench_batched() -> float:
+    rpc = RpcController(State({}, {}), threading.Event(), core_cmd=SINK)
+    channel: queue.Queue = queue.Queue()
+    for _ in range(N):
+        channel.put(_edit())
+    channel.put(('kill', {}, None))
+    start = perf_counter()
+    XiChannel(channel).process_requests(rpc)  # includes rpc.kill()
+    return N / (perf_counter() - start)
+
+
+def run() -> dict[str, float]:
+    return {'flush per message': bench_unbatched(), 'batched': bench_batched()}
+
+
+if __name__ == '__main__':
+    report(TITLE, run(), UNIT)
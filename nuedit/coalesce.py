@@ -0,0 +1,88 @@
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+from time import monotonic
+from typing import Optional, Union
+
+from .XiChannel import Channel, Result, XiChannel
+from .latency import LATENCY
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import multiprocessing as mp
+
+
+def is_drag(req: dict) -> bool:
+    return req['method'] == 'gesture' and 'select_extend' in req['params']['ty']
+
+
+class CoalescingChannel(XiChannel):
+    """A XiChannel for the UI: edits made on the event loop (key bindings, mouse handlers)
+    are held back until the current burst of input is handled, and then sent in one batch.
+
+    While held back:
+     * consecutive `insert`s into a view are merged into one `insert`
+       (Xi puts consecutive inserts in the same undo group anyway, so undo is unchanged)
+     * repeated movement commands (key repeat) are sent together in one batch
+       (Xi has no repeat count, so they can't be merged into a single command)
+     * only the latest drag position is kept, and drags are sent at most once per frame
+
+    Edits from other threads, and everything sent with `put()`, flush the held back edits first,
+    so the order of the requests never changes.
+    """
+    def __init__(self, rpc_channel: Channel, max_fps: int = 60, replies: Optional[Channel] = None):
+        super().__init__(rpc_channel, replies)
+        self.frame_time = 1 / max_fps
+        self._pending: list[dict] = []
+        self._lock = threading.Lock()
+        self._flush_at: Optional[float] = None  # when the scheduled flush runs (None if not scheduled)
+        self.edits_received = 0
+        self.edits_sent = 0
+
+    def __getstate__(self):
+        raise TypeError("CoalescingChannel only lives in the UI (pass the XiChannel to other processes)")
+
+    def put(self, method: str, params: dict = {}, result: Optional[Result] = None):
+        self.flush()
+        super().put(method, params, result)
+
+    def edit(self, method: str, params: Union[dict, list], view_id: str):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # not on the event loop (e.g. a view's _bg_worker), send right away
+            self.flush()
+            self.edits_received += 1
+            self.edits_sent += 1
+            return super().edit(method, params, view_id)
+
+        req: dict = {'method': method, 'params': params, 'view_id': view_id}
+        with self._lock:
+            self.edits_received += 1
+            last = self._pending[-1] if self._pending else None
+            if last is not None and last['view_id'] == view_id and last['method'] == method == 'insert':
+                last['params'] = {'chars': last['params']['chars'] + req['params']['chars']}
+            elif last is not None and last['view_id'] == view_id and is_drag(last) and is_drag(req):
+                self._pending[-1] = req
+            else:
+                self._pending.append(req)
+            # Drags wait for the next frame, everything else is sent when the current input is handled:
+            delay = self.frame_time if all(is_drag(r) for r in self._pending) else 0.0
+            if self._flush_at is None or monotonic() + delay < self._flush_at:
+                self._flush_at = monotonic() + delay
+                loop.call_later(delay, self._scheduled_flush, self._flush_at)
+
+    def _scheduled_flush(self, flush_at: float) -> None:
+        if self._flush_at == flush_at:  # else it was flushed (or rescheduled) already
+            self.flush()
+
+    def flush(self) -> None:
+        """Send the held back edits (if any)"""
+        with self._lock:
+            pending, self._pending, self._flush_at = self._pending, [], None
+            if pending:
+                self.edits_sent += len(pending)
+                logging.debug("[Coalesce] Sending %d edits (%d received, %d sent)", len(pending), self.edits_received, self.edits_sent)
+                for view_id in {req['view_id'] for req in pending}:
+                    LATENCY.queued(view_id)
+                self.put_many([('edit', req, None) for req in pending])
@@ -0,0 +1,50 @@
+"""JSON codecs for the newline delimited JSON spoken with Xi-core.
+
+orjson or msgspec is used when installed, otherwise the stdlib json module.
+All codecs work on bytes, so lines can be decoded straight from the pipe buffer.
+"""
+import json
+import logging
+from typing import Any, Callable, NamedTuple, Optional
+
+
+class Codec(NamedTuple):
+    name: str
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+def _orjson() -> Codec:
+    import orjson
+    return Codec('orjson', orjson.dumps, orjson.loads)
+
+
+def _msgspec() -> Codec:
+    import msgspec
+    return Codec('msgspec', msgspec.json.Encoder().encode, msgspec.json.Decoder().decode)
+
+
+def _json() -> Codec:
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    return Codec('json', lambda obj: encoder.encode(obj).encode(), json.loads)
+
+
+# In order of preference:
+CODECS: dict[str, Callable[[], Codec]] = {
+    'orjson': _orjson,
+    'msgspec': _msgspec,
+    'json': _json,
+}
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """ Returns the codec `name` (if installed) or else the first installed codec from `CODECS` """
+    if name is not None and name not in CODECS:
+        logging.warning(f"[Codec] Unknown JSON codec: {name}")
+    preferred = [name] if name in CODECS else []
+    for candidate in preferred + list(CODECS):
+        try:
+            return CODECS[candidate]()
+        except ImportError:
+            logging.debug(f"[Codec] {candidate} not installed")
+    raise AssertionError("Unreachable: the json codec is always available")
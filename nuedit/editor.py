@@ -1,74 +1,177 @@
+from __future__ import annotations
 import logging
-from multiprocessing.managers import DictProxy
-import multiprocessing as mp
-from multiprocessing.synchronize import Event as MpEvent  # for typing
+import queue
+import sys
 import threading
-from typing import Any, TypedDict
+from contextlib import contextmanager
+from typing import Callable, Iterator, NamedTuple, Optional
 from yaml import safe_load
 
-from .XiChannel import XiChannel
+from . import log
+from .log import STARTUP
+from .XiChannel import Channel, RemoteReply, Sink, XiChannel
 from .rpc import RpcController
-from .view import GlobalView
+from .state import DEFAULT_STYLES, State
 
+# The UI (prompt_toolkit) takes most of the startup to import, so it's imported (and built) after
+# Xi and the backend are started, which then start up concurrently:
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import multiprocessing as mp
+    from multiprocessing.synchronize import Event as MpEvent
+    from .view import GlobalView
 
-#class SharedSettings(TypedDict):
-#    settings: DictProxy[str, Any]
-#    styles: DictProxy[Any, str]  # maps strings (e.g "finstrd") but also "style id" (e.g. 0) to a style (e.g. "bg:black")
-#    view_channels: DictProxy[str, mp.Queue]  # {view_id: view_channel_queue}
-#    focused_view: str
+MODES = ('single-process', 'multi-process', 'asyncio')
 
-def editor(files: list):
+
+class Backend(NamedTuple):
+    new_queue: Callable[[], Channel]  # creates the queues shared with the backend (view channels, results)
+    state: State  # the replica of the state used by the UI
+    rpc_queue: Channel  # the queue of the XiChannel processed by the backend
+    replies: Optional[Channel]  # the results of XiChannel.call (None if the backend runs in this process)
+
+
+def editor(files: list, mode: str = 'single-process', profile_startup: bool = False, profile_latency: bool = False):
     logging.debug("[MAIN] App started")
 
     with open('settings.yaml') as f:
         global_settings = safe_load(f)
-
+    log.set_level(global_settings.get('log_level'))
+    STARTUP.mark('settings parsed')
+
+    if mode == 'asyncio':
+        import asyncio
+        asyncio.run(async_editor(files, global_settings))
+    else:
+        start_backend = single_process_backend if mode == 'single-process' else multi_process_backend
+        with start_backend(global_settings) as backend:
+            STARTUP.mark('backend started')
+            from .coalesce import CoalescingChannel
+            from .view import GlobalView
+            STARTUP.mark('UI imported')
+            # The UI coalesces its edits before putting them on the rpc queue:
+            v = GlobalView(backend.new_queue, backend.state, CoalescingChannel(backend.rpc_queue, global_settings.get('max_fps', 60), backend.replies))
+            _run(v, files)
+
+    if profile_startup:
+        print(STARTUP.report(), file=sys.stderr)
+    if profile_latency:
+        from .latency import LATENCY
+        print(LATENCY.report(), file=sys.stderr)
+
+
+def _run(v: GlobalView, files: list) -> None:
+    v.app.after_render += _first_paint
+    STARTUP.mark('UI built')
+    v.fileman_visible = len(files) == 0
+    v.new_views(files)
+
+    v.app.run()  # blocks until editor exits
+    logging.debug("[MAIN] Shutting down")
+
+    assert len(v.views) == 0, f"Views not closed: {v.views}"
+    # while len(v.views) != 0:
+    #    print(f"Waiting for {v.views.keys()} to shutdown.")
+    #    sleep(.1)
+    v.rpc_channel.flush()
+
+
+def _first_paint(app) -> None:
+    STARTUP.mark('first paint')
+
+
+@contextmanager
+def single_process_backend(global_settings: dict, core_cmd: Optional[list[str]] = None) -> Iterator[Backend]:
+    """RpcController runs on threads of this process and is fed by plain queues (the default)"""
+    # The backend threads share the state with the UI:
+    state = State(global_settings, dict(DEFAULT_STYLES))
+    rpc_queue: queue.Queue = queue.Queue()
+    rpc = RpcController(state, threading.Event(), core_cmd)
+    threads = [
+        threading.Thread(target=RpcController.bg_worker, args=(rpc, )),
+        threading.Thread(target=XiChannel(rpc_queue).process_requests, args=(rpc, )),
+    ]
+    for thread in threads:
+        thread.start()
+    logging.debug("[MAIN] RPC ready (single-process)")
+    try:
+        yield Backend(queue.Queue, state, rpc_queue, None)
+    finally:
+        XiChannel(rpc_queue).put('kill')
+        for thread in threads:
+            thread.join()
+
+
+@contextmanager
+def multi_process_backend(global_settings: dict, core_cmd: Optional[list[str]] = None) -> Iterator[Backend]:
+    """RpcController runs in a backend process, all queues are proxies of a mp.Manager"""
+    import multiprocessing as mp
     with mp.Manager() as manager:
         # XiChannel is a mp.Queue with a few fancy methods to put json in the right format
-        rpc_channel = XiChannel(manager.Queue())
-
-        shared_state: DictProxy[str, str|DictProxy[str|int, Any]] = manager.dict({
-            'settings': manager.dict(global_settings),
-            'styles': manager.dict({
-                'cursor': 'reverse underline',
-                'selection': 'reverse',           0: 'reverse',
-                'find': 'fg:ansiyellow bg:black', 1: 'fg:ansiyellow bg:black',
-            }),
-            'view_channels': manager.dict(), # {view_id: view-channel-queue}
-            'focused_view': 'filemanager',
-        })
+        rpc_queue = manager.Queue()
+        rpc_channel = XiChannel(rpc_queue)
+
+        # Each process has its own replica of the state, the backend pushes its changes to us:
+        state = State(global_settings, dict(DEFAULT_STYLES))
+        state_updates = manager.Queue()
+        state_follower = threading.Thread(target=state.follow, args=(state_updates, ))
+        state_follower.start()
+
         rpc_ready = manager.Event()
+        # A single queue for the results of all calls. A mp.Queue, not a manager queue, so (large) results
+        # are pickled once and sent straight to this process:
+        replies: mp.Queue = mp.Queue()
 
         logging.debug("[MAIN] Starting backend process")
-        p = mp.Process(target=backend_process, args=(rpc_ready, shared_state, rpc_channel))
+        backend_state = State(global_settings, dict(DEFAULT_STYLES), outbox=state_updates)
+        p = mp.Process(target=backend_process, args=(rpc_ready, backend_state, rpc_channel, replies, core_cmd))
         p.start()
+        # Requests can be queued right away (the backend starts processing them once Xi is running),
+        # so don't wait for `rpc_ready` here.
+        try:
+            yield Backend(manager.Queue, state, rpc_queue, replies)
+        finally:
+            rpc_channel.put('kill')
+            p.join()
+            replies.put(None)  # stops dispatching replies
+            state_updates.put(None)
+            state_follower.join()
+
+
+async def async_editor(files: list, global_settings: dict):
+    from .aio import AsyncRpc, AsyncXiChannel
+    from .view import GlobalView
+    STARTUP.mark('UI imported')
+    # Everything runs on the event loop, so a single replica of the state is enough:
+    state = State(global_settings, dict(DEFAULT_STYLES))
+    rpc = AsyncRpc(state)
+    await rpc.start()
+    logging.debug("[MAIN] RPC ready (asyncio)")
+    STARTUP.mark('backend started')
+
+    v = GlobalView(None, state, AsyncXiChannel(rpc, global_settings.get('max_fps', 60)))
+    v.app.after_render += _first_paint
+    STARTUP.mark('UI built')
+    v.fileman_visible = len(files) == 0
+    v.new_views(files)
+
+    await v.app.run_async()  # returns when editor exits
+    logging.debug("[MAIN] Shutting down")
+    v.rpc_channel.flush()
+    await rpc.stop()
+
+
+def backend_process(rpc_ready: MpEvent, state: State, rpc_channel: XiChannel, replies: Sink, core_cmd: Optional[list[str]] = None):
+    log.setup(state.settings.get('log_level'), filemode='a')  # the log listener thread isn't forked
+    RemoteReply.replies = replies
+    try:
+        rpc = RpcController(state, rpc_ready, core_cmd)
+
+        thread = threading.Thread(target=RpcController.bg_worker, args=(rpc, ))
+        thread.start()
 
-        logging.debug("[MAIN] Waiting for RPC")
         rpc_ready.wait()
-        logging.debug("[MAIN] RPC ready")
-
-        v = GlobalView(manager, shared_state, rpc_channel)
-        v.fileman_visible = len(files) == 0
-        for file in files:
-            v.new_view(file)
-
-        v.app.run()  # blocks until editor exits
-        logging.debug("[MAIN] Shutting down")
-
-        assert len(v.views) == 0, f"Views not closed: {v.views}"
-        # while len(v.views) != 0:
-        #    print(f"Waiting for {v.views.keys()} to shutdown.")
-        #    sleep(.1)
-        rpc_channel.put('kill')
-        p.join()
-
-
-def backend_process(rpc_ready: MpEvent, shared_state: dict, rpc_channel: XiChannel):
-    rpc = RpcController(shared_state, rpc_ready)
-
-    thread = threading.Thread(target=RpcController.bg_worker, args=(rpc, ))
-    thread.start()
-
-    rpc_ready.wait()
-    rpc_channel.process_requests(rpc)  # blocking
-    thread.join()
+        rpc_channel.process_requests(rpc)  # blocking
+        thread.join()
+    finally:
+        log.stop()  # atexit isn't called in mp.Process
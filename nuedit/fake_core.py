@@ -0,0 +1,323 @@
+"""A stand-in for xi-core, speaking the same newline-delimited JSON protocol (on stdin/stdout).
+
+Every view is a synthetic document of `--lines` lines (or the file, if it exists and `--lines` isn't
+given) with `--styles` style spans per line and `--annotations` find hits spread over the document.
+Like Xi, only the lines in the scroll region are sent, and lines the frontend already has are copied.
+
+Handles `client_started`, `new_view`, `close_view` and the `edit`s `insert`, `paste`,
+`insert_newline`, `delete_backward`, `delete_forward`, the basic movements, `gesture` (point, select
+and select_extend), `find` (with `find_status`), `find_next`, `find_previous`, `scroll` and
+`request_lines`. Opening a directory fails (like in Xi), other requests with an id are answered
+with a null result.
+
+Select it with the `xi_core` setting or `$NUEDIT_XI_CORE`, e.g.:
+
+    NUEDIT_XI_CORE="python -m nuedit.fake_core --lines 1000000" python -m nuedit README.md
+"""
+import argparse
+import itertools
+import os
+import re
+import sys
+from bisect import bisect_left, bisect_right
+from typing import Callable, Optional, Union
+
+from .codec import get_codec
+
+N_STYLES = 4  # style ids used (defined with def_style), 0 and 1 are reserved for selections and find
+CODEC = get_codec()
+
+
+def send(msg: dict) -> None:
+    sys.stdout.buffer.write(CODEC.dumps(msg) + b'\n')
+
+
+class Document:
+    """Lines as segments: ranges of synthetic lines (generated when read) or lists of edited lines"""
+    def __init__(self, lines: Union[int, list[str]], line_length: int):
+        self.line_length = line_length
+        self.segments: list[Union[range, list[str]]] = [range(lines) if isinstance(lines, int) else lines]
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self.segments = [s for s in self.segments if len(s)] or [[""]]  # a document always has a line
+        self._starts = []
+        total = 0
+        for segment in self.segments:
+            self._starts.append(total)
+            total += len(segment)
+        self._len = total
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> str:
+        s = bisect_right(self._starts, i) - 1
+        line = self.segments[s][i - self._starts[s]]
+        return line if isinstance(line, str) else self.synthetic(line)
+
+    def synthetic(self, n: int) -> str:
+        text = f"{n + 1:>7}: " + "lorem ipsum dolor sit amet " * (self.line_length // 27 + 1)
+        return text[:self.line_length]
+
+    def replace(self, first: int, removed: int, lines: list[str]) -> None:
+        """ Replace `removed` lines starting from `first` by `lines` """
+        segments: list[Union[range, list[str]]] = []
+        inserted = False
+        for (start, segment) in zip(self._starts, self.segments):
+            stop = start + len(segment)
+            if start < first:
+                segments.append(segment[:first - start])
+            if not inserted and stop > first:
+                segments.append(lines)
+                inserted = True
+            if stop > first + removed:
+                segments.append(segment[max(0, first + removed - start):])
+        if not inserted:  # appended at the end
+            segments.append(lines)
+        self.segments = segments
+        self._reindex()
+
+
+class View:
+    """A view of `doc`, its notifications are passed to `out` (written to stdout by default)"""
+    def __init__(self, view_id: str, doc: Document, styles: int, annotations: int, height: int,
+                 out: Callable[[dict], None] = send):
+        self.view_id = view_id
+        self.out = out
+        self.doc = doc
+        self.styles = styles
+        self.annotations = annotations
+        self.cursor = (0, 0)  # (line, col)
+        self.anchor: Optional[tuple[int, int]] = None  # the other end of the selection
+        self.query: Optional[re.Pattern] = None  # of the current find
+        self.hits: list[tuple[int, int, int]] = []  # (line, start col, end col) of its hits
+        self.region = (0, height)  # scroll region [first, last)
+        self.pristine = True
+        self.sent = (0, 0)  # lines [first, last) held (valid) by the frontend
+
+    def line_json(self, i: int) -> dict:
+        text = self.doc[i]
+        line: dict = {'text': text + '\n', 'ln': i + 1}
+        if self.styles:
+            # Spans of 3 characters spread over the line: [start (relative to the end of the previous span), length, style id]
+            step = max(len(text) // self.styles, 3)
+            line['styles'] = []
+            last_end = 0
+            for k in range(self.styles):
+                start = min(k * step, len(text))
+                length = min(3, len(text) - start)
+                line['styles'] += [start - last_end, length, 2 + (i + k) % N_STYLES]
+                last_end = start + length
+        if i == self.cursor[0]:
+            line['cursor'] = [self.cursor[1]]
+        return line
+
+    def update(self, changed: Optional[tuple[int, int, int]] = None, dirty: tuple[int, ...] = ()) -> None:
+        """Send an update with the lines of the scroll region
+
+        `changed` is the edit made since the last update: (first line, lines removed, lines inserted),
+        and the lines `dirty` (in the new document) are updated (new cursor) even if the frontend has them.
+        """
+        (first, removed, inserted) = changed or (0, 0, 0)
+
+        def old_index(i: int) -> Optional[int]:
+            if i < first:
+                return i
+            if i < first + inserted:
+                return None
+            return i - inserted + removed
+
+        def held(j: Optional[int]) -> bool:
+            return j is not None and self.sent[0] <= j < self.sent[1]
+
+        n = len(self.doc)
+        (top, bottom) = (max(0, min(self.region[0], n)), max(0, min(self.region[1], n)))
+        ops: list[dict] = []
+        if top:
+            ops.append({'op': 'invalidate', 'n': top})
+        pos = 0  # lines of the old document consumed
+        i = top
+        while i < bottom:
+            j = old_index(i)
+            if j is not None and held(j):
+                # Copy the run of lines the frontend holds (or update their cursor, if dirty):
+                k = i + 1
+                while k < bottom and old_index(k) == j + k - i and held(j + k - i) and (k in dirty) == (i in dirty):
+                    k += 1
+                if j > pos:
+                    ops.append({'op': 'skip', 'n': j - pos})
+                if i in dirty:
+                    ops.append({'op': 'update', 'n': k - i, 'lines': [
+                        {'ln': x + 1, 'cursor': [self.cursor[1]] if x == self.cursor[0] else []} for x in range(i, k)]})
+                else:
+                    ops.append({'op': 'copy', 'n': k - i, 'ln': i + 1})
+                pos = j + k - i  # type: ignore
+            else:
+                k = i + 1
+                while k < bottom and not held(old_index(k)):
+                    k += 1
+                ops.append({'op': 'ins', 'n': k - i, 'lines': [self.line_json(x) for x in range(i, k)]})
+            i = k
+        if bottom < n:
+            ops.append({'op': 'invalidate', 'n': n - bottom})
+        self.sent = (top, bottom)
+
+        selection = sorted((self.anchor or self.cursor, self.cursor))
+        annotations = [{'type': 'selection', 'ranges': [[*selection[0], *selection[1]]], 'payloads': None, 'n': 1}]
+        if self.query is not None:
+            hits = [[line, start, line, end] for (line, start, end) in self.hits[bisect_left(self.hits, (top, )):bisect_left(self.hits, (bottom, ))]]
+            annotations.append({'type': 'find', 'ranges': hits, 'payloads': None, 'n': len(hits)})
+        elif self.annotations:
+            step = max(n // self.annotations, 1)
+            hits = [[line, 2, line, 7] for line in range(-(-top // step) * step, bottom, step) if line // step < self.annotations]
+            annotations.append({'type': 'find', 'ranges': hits, 'payloads': None, 'n': len(hits)})
+
+        self.out({'method': 'update', 'params': {'view_id': self.view_id, 'update': {
+            'ops': ops, 'annotations': annotations, 'pristine': self.pristine}}})
+
+    def find(self) -> None:
+        """ Find the hits of the query (again) and send the `find_status` """
+        assert self.query is not None
+        self.hits = [(i, m.start(), m.end()) for i in range(len(self.doc)) for m in self.query.finditer(self.doc[i]) if m.end() > m.start()]
+        self.out({'method': 'find_status', 'params': {'view_id': self.view_id, 'queries': [{
+            'id': 1, 'chars': self.query.pattern, 'case_sensitive': not self.query.flags & re.I, 'is_regex': False,
+            'whole_words': False, 'matches': len(self.hits), 'lines': [line + 1 for (line, _, _) in self.hits]}]}})
+
+    def edit(self, method: str, params) -> None:
+        (line, col) = self.cursor
+        text = self.doc[line]
+        old_cursor_line = line
+        changed = None
+        anchor = None
+        match method:
+            case 'insert' | 'paste':
+                new = (text[:col] + params['chars'] + text[col:]).split('\n')
+                self.doc.replace(line, 1, new)
+                changed = (line, 1, len(new))
+                (line, col) = (line + len(new) - 1, len(new[-1]) - len(text) + col)
+            case 'insert_newline':
+                self.doc.replace(line, 1, [text[:col], text[col:]])
+                changed = (line, 1, 2)
+                (line, col) = (line + 1, 0)
+            case 'delete_backward' if col > 0:
+                self.doc.replace(line, 1, [text[:col - 1] + text[col:]])
+                changed = (line, 1, 1)
+                col -= 1
+            case 'delete_backward' if line > 0:
+                above = self.doc[line - 1]
+                self.doc.replace(line - 1, 2, [above + text])
+                changed = (line - 1, 2, 1)
+                (line, col) = (line - 1, len(above))
+            case 'delete_forward' if col < len(text):
+                self.doc.replace(line, 1, [text[:col] + text[col + 1:]])
+                changed = (line, 1, 1)
+            case 'delete_forward' if line + 1 < len(self.doc):
+                self.doc.replace(line, 2, [text + self.doc[line + 1]])
+                changed = (line, 2, 1)
+            case 'move_up' | 'move_down' | 'scroll_page_up' | 'scroll_page_down':
+                delta = {'move_up': -1, 'move_down': 1}.get(method, self.region[1] - self.region[0])
+                line += -delta if method == 'scroll_page_up' else delta
+            case 'move_left' if col > 0:
+                col -= 1
+            case 'move_right' if col < len(text):
+                col += 1
+            case 'move_to_left_end_of_line':
+                col = 0
+            case 'move_to_right_end_of_line':
+                col = len(text)
+            case 'move_to_beginning_of_document':
+                (line, col) = (0, 0)
+            case 'move_to_end_of_document':
+                line = len(self.doc) - 1
+                col = len(self.doc[line])
+            case 'gesture':
+                anchor = self.anchor or self.cursor if 'select_extend' in params.get('ty', {}) else None
+                (line, col) = (params['line'], params['col'])
+            case 'find':
+                chars = params['chars'] if params.get('regex') else re.escape(params['chars'])
+                self.query = re.compile(chars, 0 if params.get('case_sensitive') else re.I)
+                self.find()
+                self.update()
+                return
+            case 'find_next' | 'find_previous' if self.hits:
+                # The first hit after the selection, or the last one before it:
+                if method == 'find_next':
+                    i = bisect_left(self.hits, (line, col))
+                    i = 0 if i == len(self.hits) and params.get('wrap_around') else i
+                else:
+                    i = bisect_left(self.hits, self.anchor or self.cursor) - 1
+                    i = len(self.hits) - 1 if i < 0 and params.get('wrap_around') else i
+                if 0 <= i < len(self.hits):
+                    (line, hit_start, col) = self.hits[i]
+                    anchor = (line, hit_start)
+            case 'scroll' | 'request_lines':
+                self.region = (params[0], params[1])
+                self.update()
+                return
+            case _:
+                return
+        line = max(0, min(line, len(self.doc) - 1))
+        col = max(0, min(col, len(self.doc[line])))
+        self.cursor = (line, col)
+        self.anchor = anchor
+        if changed:
+            self.pristine = False
+            if self.query is not None:
+                self.find()
+        # Update the lines the cursor left and moved to (the edited lines are sent anyway):
+        dirty: tuple[int, ...]
+        if changed is None or not changed[0] <= old_cursor_line < changed[0] + changed[2]:
+            dirty = (old_cursor_line, line)
+        else:
+            dirty = (line, )
+        self.update(changed, dirty)
+        self.out({'method': 'scroll_to', 'params': {'view_id': self.view_id, 'line': line, 'col': col}})
+
+
+def main(argv: list[str]) -> None:
+    parser = argparse.ArgumentParser(prog='python -m nuedit.fake_core', description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, help="lines in each document (default: the file, or 1000)")
+    parser.add_argument('--line-length', type=int, default=80)
+    parser.add_argument('--styles', type=int, default=4, help="style spans per line")
+    parser.add_argument('--annotations', type=int, default=0, help="find hits per document")
+    parser.add_argument('--height', type=int, default=50, help="scroll region until the frontend sends one")
+    args = parser.parse_args(argv)
+
+    views: dict[str, View] = {}
+    view_ids = itertools.count(1)  # never reused, like xi-core's
+    for raw in sys.stdin.buffer:
+        msg = CODEC.loads(raw)
+        (method, params) = (msg.get('method'), msg.get('params') or {})
+        if method == 'client_started':
+            send({'method': 'available_themes', 'params': {'themes': ['fake']}})
+            send({'method': 'available_languages', 'params': {'languages': ['Plain Text']}})
+            for style_id in range(2, 2 + N_STYLES):
+                send({'method': 'def_style', 'params': {'id': style_id, 'fg_color': 0xff000000 | (0x3f * style_id) << 8}})
+        elif method == 'new_view' and params.get('file_path') and os.path.isdir(params['file_path']):
+            send({'id': msg['id'], 'error': {'code': 0, 'message': f"Is a directory: {params['file_path']}"}})
+        elif method == 'new_view':
+            view_id = f'view-id-{next(view_ids)}'
+            file_path = params.get('file_path')
+            if args.lines is None and file_path and os.path.isfile(file_path):
+                with open(file_path, errors='replace') as f:
+                    lines: Union[int, list[str]] = f.read().split('\n')
+            else:
+                lines = args.lines if args.lines is not None else 1000
+            views[view_id] = View(view_id, Document(lines, args.line_length), args.styles, args.annotations, args.height)
+            send({'method': 'config_changed', 'params': {'view_id': view_id, 'changes': {'tab_size': 4, 'word_wrap': False}}})
+            send({'id': msg['id'], 'result': view_id})
+            views[view_id].update()
+        elif method == 'close_view':
+            views.pop(params['view_id'], None)
+        elif method == 'edit' and params.get('view_id') in views:
+            views[params['view_id']].edit(params['method'], params.get('params'))
+            if 'id' in msg:
+                send({'id': msg['id'], 'result': None})
+        elif 'id' in msg:
+            send({'id': msg['id'], 'result': None})
+        sys.stdout.buffer.flush()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
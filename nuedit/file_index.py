@@ -0,0 +1,299 @@
+"""Index of the files of a project tree, for quick-open.
+
+`FileIndex` crawls the tree with `os.scandir` on a background thread, skipping what `.gitignore`
+files ignore (and `.git`), including the `.gitignore` files above the root up to the enclosing repository. The listing of every directory is saved to a cache file (per root, in
+~/.cache/nuedit) and reused while the mtime of the directory (and of the `.gitignore` files that
+apply to it) is unchanged, so only changed directories are listed again on the next start.
+
+`FuzzyMatcher` matches a query against the paths on a background thread, in chunks: a newer query
+cancels the running one, results are published after every chunk and a query extending the previous
+one only searches the previous matches. The key bindings never wait for more than one chunk.
+"""
+from __future__ import annotations
+import hashlib
+import heapq
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+from .codec import get_codec
+
+CACHE_DIR = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'nuedit'
+CACHE_VERSION = 1
+ALWAYS_IGNORED = {'.git'}
+STAR = '*+' if sys.version_info >= (3, 11) else '*'  # quick-open's quantifier (possessive ones are new in 3.11)
+
+
+class IgnoreRules:
+    """The rules of one `.gitignore` file (a practical subset: globs, `**`, `!`, trailing `/` and anchoring)"""
+    def __init__(self, lines: list[str]):
+        self.rules: list[tuple[re.Pattern, bool, bool, bool]] = []  # (pattern, negate, dir only, match the relative path)
+        for line in lines:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            line = line[1:] if negate else line
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            self.rules.append((re.compile(self._translate(line.lstrip('/'))), negate, dir_only, anchored))
+
+    @staticmethod
+    def _translate(glob: str) -> str:
+        regex = ''
+        i = 0
+        while i < len(glob):
+            if glob.startswith('**/', i):
+                regex += '(?:.*/)?'
+                i += 3
+            elif glob.startswith('**', i):
+                regex += '.*'
+                i += 2
+            elif glob[i] == '*':
+                regex += '[^/]*'
+                i += 1
+            elif glob[i] == '?':
+                regex += '[^/]'
+                i += 1
+            elif glob[i] == '[' and (end := glob.find(']', i + 1)) > 0:
+                regex += '[' + glob[i + 1:end].replace('!', '^', 1).replace('\\', '\\\\') + ']'
+                i = end + 1
+            else:
+                regex += re.escape(glob[i])
+                i += 1
+        return regex + r'\Z'
+
+    def match(self, rel_path: str, name: str, is_dir: bool) -> Optional[bool]:
+        """ True if ignored, False if explicitly not ignored (`!`) and None if no rule matches """
+        for (pattern, negate, dir_only, anchored) in reversed(self.rules):  # the last matching rule wins
+            if dir_only and not is_dir:
+                continue
+            if pattern.match(rel_path if anchored else name):
+                return not negate
+        return None
+
+
+class FileIndex:
+    """The (relative) paths of the files under `root`, crawled on a background thread (see above)"""
+    def __init__(self, root: Path, on_update: Callable[[], None] = lambda: None, cache_dir: Path = CACHE_DIR):
+        self.root = root.resolve()
+        self.paths: list[str] = []  # grows while crawling
+        self.done = False
+        self.on_update = on_update
+        self.cache_file = cache_dir / f"files-{hashlib.sha1(str(self.root).encode()).hexdigest()[:16]}.json"
+        self.dirs_listed = 0  # directories listed with scandir (the others came from the cache)
+        self.codec = get_codec()
+        threading.Thread(target=self._crawl, daemon=True).start()
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cache = self.codec.loads(f.read())
+            if cache.get('version') == CACHE_VERSION and cache.get('root') == str(self.root):
+                return cache['dirs']
+        except (OSError, ValueError) as e:
+            logging.debug("[FileIndex] No cache for %s: %s", self.root, e)
+        return {}
+
+    def _save_cache(self, dirs: dict) -> None:
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_file.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(self.codec.dumps({'version': CACHE_VERSION, 'root': str(self.root), 'dirs': dirs}))
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            logging.warning("[FileIndex] Can't save the cache %s: %s", self.cache_file, e)
+
+    def _ancestor_rules(self) -> tuple[str, list[tuple[str, IgnoreRules, int]]]:
+        """ (the root relative to the enclosing repository, the rules of the `.gitignore` files above the root) """
+        parents = [self.root, *self.root.parents]
+        top = next((p for p in parents if (p / '.git').exists()), self.root)
+        rules = []
+        for directory in reversed(parents[1:parents.index(top) + 1]):  # from the top down to the parent of the root
+            ignore_file = directory / '.gitignore'
+            try:
+                if ignore_file.is_file():
+                    with open(ignore_file, errors='replace') as f:
+                        base = '' if directory == top else directory.relative_to(top).as_posix()
+                        rules.append((base, IgnoreRules(f.readlines()), ignore_file.stat().st_mtime_ns))
+            except OSError as e:
+                logging.debug("[FileIndex] Skipping %s: %s", ignore_file, e)
+        return ('' if top == self.root else self.root.relative_to(top).as_posix(), rules)
+
+    def _crawl(self) -> None:
+        cached = self._load_cache()
+        dirs: dict[str, list] = {}  # {relative dir: [mtime_ns, .gitignore mtimes, files, subdirs]}
+        # The rules' base dirs are relative to the enclosing repository, the root is at `prefix` in it:
+        (prefix, ancestor_rules) = self._ancestor_rules()
+        # Depth first, each directory with the ignore rules that apply to it: [(base dir, rules, mtime)]
+        stack: list[tuple[str, list[tuple[str, IgnoreRules, int]]]] = [('', ancestor_rules)]
+        batch: list[str] = []
+        while stack:
+            (rel, rules) = stack.pop()
+            path = os.path.join(self.root, rel)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+                ignore_file = os.path.join(path, '.gitignore')
+                if os.path.isfile(ignore_file):
+                    with open(ignore_file, errors='replace') as f:
+                        rules = [*rules, (_join(prefix, rel), IgnoreRules(f.readlines()), os.stat(ignore_file).st_mtime_ns)]
+            except OSError as e:
+                logging.debug("[FileIndex] Skipping %s: %s", path, e)
+                continue
+            signature = [m for (_, _, m) in rules]
+            entry = cached.get(rel)
+            if entry is None or entry[0] != mtime or entry[1] != signature:
+                entry = [mtime, signature, *self._list(path, _join(prefix, rel), rules)]
+                self.dirs_listed += 1
+            dirs[rel] = entry
+            (_, _, files, subdirs) = entry
+            batch.extend(f"{rel}/{name}" if rel else name for name in files)
+            stack.extend((f"{rel}/{name}" if rel else name, rules) for name in reversed(subdirs))
+            if len(batch) >= 4096:
+                self.paths.extend(batch)
+                batch = []
+                self.on_update()
+        self.paths.extend(batch)
+        self.done = True
+        self.on_update()
+        logging.debug("[FileIndex] %d files in %s (%d of %d dirs listed)", len(self.paths), self.root, self.dirs_listed, len(dirs))
+        if self.dirs_listed or len(dirs) != len(cached):
+            self._save_cache(dirs)
+
+    @staticmethod
+    def _list(path: str, rel: str, rules: list[tuple[str, IgnoreRules, int]]) -> tuple[list[str], list[str]]:
+        """ The (not ignored) files and subdirectories of `path` (`rel` in the repository) """
+        (files, subdirs) = ([], [])
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name in ALWAYS_IGNORED:
+                        continue
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if FileIndex._ignored(rules, f"{rel}/{entry.name}" if rel else entry.name, entry.name, is_dir):
+                        continue
+                    if is_dir:
+                        subdirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+        except OSError as e:
+            logging.debug("[FileIndex] Can't list %s: %s", path, e)
+        return (files, subdirs)
+
+    @staticmethod
+    def _ignored(rules: list[tuple[str, IgnoreRules, int]], rel_path: str, name: str, is_dir: bool) -> bool:
+        for (base, ignore_rules, _) in reversed(rules):  # the deepest .gitignore wins
+            ignored = ignore_rules.match(rel_path[len(base) + 1:] if base else rel_path, name, is_dir)
+            if ignored is not None:
+                return ignored
+        return False
+
+
+def _join(base: str, rel: str) -> str:
+    return f"{base}/{rel}" if base and rel else base or rel
+
+
+class FuzzyMatcher:
+    """Ranks the paths of a FileIndex matching a query (its characters in order, ignoring case).
+
+    Best first: the query in the file name, then its characters in the file name, then anywhere
+    in the path. Shorter paths first within each. `on_results` is called (from the background
+    thread) whenever `results` change.
+    """
+    CHUNK = 8192  # paths matched at a time (the GIL isn't released while matching a chunk)
+    LIMIT = 50  # results kept
+
+    def __init__(self, index: FileIndex, on_results: Callable[[], None] = lambda: None):
+        self.index = index
+        self.on_results = on_results
+        self.results: list[str] = []
+        self.done = True  # all paths searched for the current query
+        self._query: Optional[str] = None
+        self._wake = threading.Event()
+        self._closed = False
+        # Matches of the last query searched to the end: (query, paths searched, matches)
+        self._previous: tuple[str, int, list[str]] = ('', 0, [])
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def search(self, query: str) -> None:
+        """ Start searching `query` (cancels the running search) """
+        self._query = query
+        self.done = False
+        self._wake.set()
+
+    @staticmethod
+    def patterns(query: str) -> tuple[re.Pattern, re.Pattern, re.Pattern]:
+        """ (anywhere in the path, in the file name, the query in the file name), the last one is for `search` """
+        def subsequence(extra: str) -> str:
+            # [^e]*e[^d]*d... is linear, and possessive ([^e]*+e) it doesn't backtrack when a character is missing
+            return ''.join(f"[^{re.escape(c)}{extra}]{STAR}{re.escape(c)}" for c in query)
+        return (
+            re.compile(subsequence(''), re.I),
+            re.compile(f"(?:.*/)?{subsequence('/')}[^/]*\\Z", re.I),
+            re.compile(f"{re.escape(query)}[^/]*\\Z", re.I),
+        )
+
+    def close(self) -> None:
+        """ Stop the background thread """
+        self._query = None
+        self._closed = True
+        self._wake.set()
+
+    def _worker(self) -> None:
+        while not self._closed:
+            self._wake.wait()
+            self._wake.clear()
+            query = self._query
+            if query is not None:
+                self._match(query)
+
+    def _match(self, query: str) -> None:
+        paths = self.index.paths
+        n = len(paths)  # paths are only ever appended
+        (previous, searched, matches) = self._previous
+        if previous and query.startswith(previous):
+            candidates = [matches, paths[searched:n]]  # only the previous matches, and the paths added since
+        else:
+            candidates = [paths[:n]]
+        patterns = self.patterns(query)
+        best: tuple[list[str], list[str], list[str]] = ([], [], [])
+        found: list[str] = []
+        while True:
+            for candidate_paths in candidates:
+                for start in range(0, len(candidate_paths), self.CHUNK):
+                    if self._query != query:
+                        return  # cancelled by a newer query
+                    self._match_chunk(patterns, candidate_paths[start:start + self.CHUNK], best, found)
+                    self._publish(query, best)
+            if self.index.done and n == len(paths):
+                break
+            if n == len(paths):  # wait for the crawl to find more
+                time.sleep(0.05)
+            candidates = [paths[n:len(paths)]]
+            n += len(candidates[0])
+        if self._query == query:
+            self._previous = (query, n, found)
+            self.done = True
+            self._publish(query, best)
+
+    def _match_chunk(self, patterns: tuple[re.Pattern, re.Pattern, re.Pattern], paths: list[str],
+                     best: tuple[list[str], list[str], list[str]], found: list[str]) -> None:
+        (anywhere, in_name, in_name_exact) = patterns
+        chunk = list(filter(anywhere.match, paths))
+        found.extend(chunk)
+        best[0][:] = heapq.nsmallest(self.LIMIT, best[0] + list(filter(in_name_exact.search, chunk)), key=len)
+        if len(best[0]) < self.LIMIT:  # else the other matches can't make it into the results
+            best[1][:] = heapq.nsmallest(self.LIMIT, best[1] + list(filter(in_name.match, chunk)), key=len)
+            best[2][:] = heapq.nsmallest(self.LIMIT, best[2] + chunk, key=len)
+
+    def _publish(self, query: str, best: tuple[list[str], list[str], list[str]]) -> None:
+        if self._query == query:
+            self.results = list(dict.fromkeys(best[0] + best[1] + best[2]))[:self.LIMIT]
+            self.on_results()
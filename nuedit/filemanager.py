@@ -1,7 +1,10 @@
 from __future__ import annotations
 import logging
-
-from typing import Callable, List
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable, List, Optional
 from pathlib import Path
 
 # from prompt_toolkit.application.current import get_app
@@ -13,8 +16,9 @@ from prompt_toolkit.widgets import (
     Label,
 )
 from prompt_toolkit.layout.margins import ScrollbarMargin
-from prompt_toolkit.layout.controls import FormattedTextControl
-from prompt_toolkit.formatted_text import to_formatted_text
+from prompt_toolkit.layout.controls import UIContent, UIControl
+from prompt_toolkit.data_structures import Point
+from prompt_toolkit.formatted_text import StyleAndTextTuples
 from prompt_toolkit.layout.containers import DynamicContainer, Container, Window
 from prompt_toolkit.key_binding import ConditionalKeyBindings
 from prompt_toolkit.key_binding.key_bindings import KeyBindings
@@ -34,37 +38,79 @@ if TYPE_CHECKING:
 #         yield Completion('completion4', start_position=0, display=HTML('<b>completion</b><ansired>1</ansired>'), style='bg:ansiyellow')
 
 
+class Listing:
+    """The entries of a directory, listed with `os.scandir` on a background thread.
+
+    Entries are streamed in (in batches, `on_batch` is called after each), so the first entries
+    of a huge directory show up right away. Each batch is sorted for type-ahead, so the index is
+    built as the entries arrive (without holding the GIL for one big sort).
+    """
+    BATCH = 1024
+
+    def __init__(self, path: Path, mtime: int, on_batch: Callable[[], None]):
+        self.path = path
+        self.mtime = mtime  # of the directory when listed (a newer mtime invalidates the listing)
+        self.values: List[str] = ['../']
+        self.styles: List[str] = [FileList.STYLE_DIR]
+        self.done = False
+        self._on_batch = on_batch
+        self._runs: List[tuple[List[str], List[int]]] = [(['../'], [0])]  # per batch: sorted values and their indexes
+        threading.Thread(target=self._list, daemon=True).start()
+
+    def _list(self) -> None:
+        (values, styles) = ([], [])
+        try:
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    # DirEntry.is_file()/is_dir() don't stat (except symlinks):
+                    if entry.is_file():
+                        values.append(entry.name)
+                        styles.append(FileList.STYLE_FILE)
+                    elif entry.is_dir():
+                        values.append(entry.name + '/')
+                        styles.append(FileList.STYLE_DIR)
+                    else:
+                        values.append(entry.name + '|')
+                        styles.append(FileList.STYLE_OTHER)
+                    if len(values) == Listing.BATCH:
+                        self._add(values, styles)
+                        (values, styles) = ([], [])
+        except OSError as e:
+            logging.warning("[FM] Can't list %s: %s", self.path, e)
+        self._add(values, styles)
+        self.done = True
+        self._on_batch()
+
+    def _add(self, values: List[str], styles: List[str]) -> None:
+        start = len(self.values)
+        order = sorted(range(len(values)), key=values.__getitem__)
+        # Styles first, as readers use len(values):
+        self.styles.extend(styles)
+        self.values.extend(values)
+        self._runs.append(([values[i] for i in order], [start + i for i in order]))
+        self._on_batch()
+
+    def find(self, prefix: str, after: int) -> Optional[int]:
+        """ Index of the first value starting with `prefix` after index `after` (wrapping around) """
+        matches = []
+        for (values, indexes) in self._runs[:]:
+            lo = bisect_left(values, prefix)
+            matches.extend(indexes[lo:bisect_left(values, prefix + '\U0010ffff', lo)])
+        return min((i for i in matches if i > after), default=min(matches, default=None))
+
+
 class FileList:
     STYLE_FILE = ''
     STYLE_DIR = ''
     STYLE_OTHER = 'fg:red'
 
-    def __init__(self, fm: Filemanager, handler: Callable[[str], None]):
+    def __init__(self, fm: Filemanager, listing: Listing, handler: Callable[[str], None]):
         self.fm = fm
-        self.values: List[str] = ['../']
-        self._styles = [FileList.STYLE_DIR]
+        self.listing = listing
         self._selected_index: int = 0
         self._file_handler = handler
 
-        for f in fm.cwd.iterdir():
-            if f.is_file():
-                self.values.append(f.name)
-                self._styles.append(FileList.STYLE_FILE)
-            elif f.is_dir():
-                self.values.append(f.name + '/')
-                self._styles.append(FileList.STYLE_DIR)
-            # elif f.is_symlink():
-            #    self.values.append(f.name + ' -> ' + os.path.realpath(f))
-            #    self._styles.append(FileList.STYLE_SYMLINK)
-            else:
-                self.values.append(f.name + '|')
-                self._styles.append(FileList.STYLE_OTHER)
-
-        self.input_field = FormattedTextControl(
-            self._get_text_fragments,
-            show_cursor=False,
-            key_bindings=self._get_filemanager_kb(fm),
-            focusable=True)
+        self.input_field = FileListControl(self, key_bindings=self._get_filemanager_kb(fm))
 
         self.window = Window(
             content=self.input_field,
@@ -77,6 +123,10 @@ class FileList:
     def __pt_container__(self) -> Container:
         return self.window
 
+    @property
+    def values(self) -> List[str]:
+        return self.listing.values
+
     @property
     def selected(self) -> str:
         return self.values[self._selected_index]
@@ -129,46 +179,63 @@ class FileList:
         @kb.add('<any>')
         def _(event: E) -> None:
             # We first check values after the selected value, then all values.
-            for value in self.values[self._selected_index + 1:] + self.values:
-                if value.startswith(event.data):
-                    self._selected_index = self.values.index(value)
-                    return
+            index = self.listing.find(event.data, self._selected_index)
+            if index is not None:
+                self._selected_index = index
 
         return ConditionalKeyBindings(kb, filter=kb_active)
 
-    def _get_text_fragments(self):
-        def mouse_handler(mouse_event: MouseEvent) -> None:
-            if mouse_event.event_type == MouseEventType.MOUSE_UP:
-                self._selected_index = mouse_event.position.y
-                self._on_enter()
 
-        result = []
-        for i, value in enumerate(self.values):
-            if i == self._selected_index:
-                result.append(('[SetCursorPosition]', ''))
-            result.extend(to_formatted_text(value, style=self._styles[i]))
-            result.append(('', '\n'))
+class FileListControl(UIControl):
+    """Renders the entries of a FileList, only the visible lines are built (by prompt_toolkit's Window)"""
+    def __init__(self, filelist: FileList, key_bindings: ConditionalKeyBindings):
+        self.filelist = filelist
+        self.key_bindings = key_bindings
+
+    def is_focusable(self) -> bool:
+        return True
+
+    def preferred_height(self, width: int, max_available_height: int, wrap_lines: bool, get_line_prefix) -> int:
+        return len(self.filelist.values)
+
+    def create_content(self, width: int, height: int) -> UIContent:
+        listing = self.filelist.listing
 
-        # Add mouse handler to all fragments.
-        for i in range(len(result)):
-            result[i] = (result[i][0], result[i][1], mouse_handler)
+        def get_line(i: int) -> StyleAndTextTuples:
+            return [(listing.styles[i], listing.values[i])]
 
-        result.pop()  # Remove last newline.
-        return result
+        return UIContent(
+            get_line=get_line,
+            line_count=len(listing.values),
+            cursor_position=Point(x=0, y=self.filelist._selected_index),
+            show_cursor=False)
+
+    def mouse_handler(self, mouse_event: MouseEvent):
+        if mouse_event.event_type == MouseEventType.MOUSE_UP:
+            self.filelist._selected_index = mouse_event.position.y
+            self.filelist._on_enter()
+            return None
+        return NotImplemented
+
+    def get_key_bindings(self) -> ConditionalKeyBindings:
+        return self.key_bindings
 
 
 class Filemanager:
+    MAX_LISTINGS = 16  # directory listings kept (reused while the mtime of the directory is unchanged)
+
     def __init__(self, view: 'GlobalView'):
         self.view = view
         self.cwd: Path = Path('./').resolve()
         self.cancel_button = Button(text="Exit", handler=self.exit_handler)
 
-        self.filelist = FileList(self, view.new_view)
+        self._listings: OrderedDict[Path, Listing] = OrderedDict()
+        self.filelist = FileList(self, self.listing(self.cwd), view.new_view)
 
         self.window = Dialog(
             title = "Browse files",
             body = DynamicContainer(lambda: HSplit([
-                Label(text = f"Dir: {self.cwd}", dont_extend_height = True),
+                Label(text = self._title(), dont_extend_height = True),
                 self.filelist,
             ], padding = D(preferred=1, max=1))),
             buttons = [self.cancel_button],
@@ -181,10 +248,32 @@ class Filemanager:
     def input_field(self):
         return self.filelist.input_field
 
+    def _title(self) -> str:
+        listing = self.filelist.listing
+        return f"Dir: {self.cwd}" + ("" if listing.done else f" (listing... {len(listing.values) - 1} entries)")
+
+    def _listed(self) -> None:
+        if app := getattr(self.view, 'app', None):  # the first listing starts while the app is built
+            app.invalidate()
+
+    def listing(self, path: Path) -> Listing:
+        """ The (cached) listing of `path`, listed again if the directory changed """
+        try:
+            mtime = path.stat().st_mtime_ns
+        except OSError:
+            mtime = -1
+        listing = self._listings.pop(path, None)
+        if listing is None or listing.mtime != mtime:
+            listing = Listing(path, mtime, on_batch=self._listed)
+        self._listings[path] = listing
+        while len(self._listings) > Filemanager.MAX_LISTINGS:
+            self._listings.popitem(last=False)
+        return listing
+
     def change_dir(self, new_dir: Path):
-        self.cwd = self.cwd.joinpath(new_dir)
-        self.filelist = FileList(self, self.view.new_view)  # recreate to use new self.cwd
-        self.view.app.invalidate()  # fix focus
+        self.cwd = self.cwd.joinpath(new_dir).resolve()
+        self.filelist = FileList(self, self.listing(self.cwd), self.view.new_view)  # recreate to use new self.cwd
+        self.view.app.layout.focus(self.filelist)  # the previous FileList had the focus
 
     def exit_handler(self) -> None:
         logging.debug("[FileMan] exit_handler")
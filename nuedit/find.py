@@ -0,0 +1,84 @@
+"""The hits of the current find in a view, to jump to the next/previous hit from the cursor.
+
+Xi reports the hits in two ways: the `find` annotations of each update (with columns, but only
+for the lines sent to the frontend) and `find_status` (the number of hits and, in recent versions,
+the line of every hit). Both are kept sorted, so the next hit from the cursor is found by bisecting.
+It's selected directly if every hit line between the cursor and it is held by the frontend, else
+(off-screen, or Xi doesn't send the lines) Xi's `find_next`/`find_previous` finds it.
+"""
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Optional
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .line_cache import AnnotationSet
+
+Range = tuple[int, int, int, int]  # (start line, start col, end line, end col), 0-indexed
+
+
+class Held(NamedTuple):
+    """The hits in the lines held by the frontend (Xi's ranges are sorted and disjoint)"""
+    ranges: list[Range]
+    starts: list[tuple[int, int]]
+    ends: list[tuple[int, int]]
+    lines: list[int]  # the distinct start lines
+
+
+class FindIndex:
+    def __init__(self) -> None:
+        self.chars: Optional[str] = None  # the current query (None: no find)
+        self.matches = 0  # total number of hits
+        self._lines: Optional[list[int]] = None  # the (distinct) lines with hits, if Xi sends them
+        self._occurrences: Optional[list[int]] = None  # the line of every hit, if Xi sends one per hit
+        # Replaced as a whole by the view's _bg_worker, the UI reads it once (without a lock):
+        self._held = Held([], [], [], [])
+
+    def set_status(self, queries: list[dict]) -> None:
+        """ From `find_status`: {'id', 'chars', 'matches', 'lines' (1-indexed, optional), ...} per query """
+        if not queries:
+            (self.chars, self.matches, self._lines, self._occurrences) = (None, 0, None, None)
+            return
+        query = queries[0]  # the search toolbar only runs one query at a time
+        lines = query.get('lines')
+        occurrences = None if lines is None else sorted(ln - 1 for ln in lines)
+        self._lines = None if occurrences is None else sorted(set(occurrences))
+        self._occurrences = occurrences if occurrences is not None and len(occurrences) == query.get('matches') else None
+        (self.chars, self.matches) = (query.get('chars'), query.get('matches') or 0)
+
+    def set_ranges(self, annotations: list[AnnotationSet]) -> None:
+        """ From the `find` annotations of an update """
+        ranges: list[Range] = sorted(tuple(r) for a in annotations if a['type'] == 'find' for r in a['ranges'])  # type: ignore
+        self._held = Held(ranges, [(r[0], r[1]) for r in ranges], [(r[2], r[3]) for r in ranges], sorted({r[0] for r in ranges}))
+
+    def next(self, cursor: tuple[int, int], forward: bool = True) -> Optional[Range]:
+        """ The next (or previous) hit from `cursor` (line, col), None if it isn't held by the frontend """
+        (ranges, starts, ends, range_lines) = self._held
+        if forward:
+            i = bisect_left(starts, cursor)
+        else:
+            i = bisect_left(ends, cursor) - 1  # hits ending before the cursor (a selected hit ends at it)
+        if not 0 <= i < len(ranges) or self._lines is None:
+            return None
+        hit = ranges[i]
+        (first, last) = sorted((cursor[0], hit[0]))
+        # All hit lines between the cursor and the hit (inclusive) must be held, else the next hit may be off-screen:
+        held = bisect_right(range_lines, last) - bisect_left(range_lines, first)
+        if held != bisect_right(self._lines, last) - bisect_left(self._lines, first):
+            return None
+        return hit
+
+    def position(self, cursor: tuple[int, int]) -> Optional[int]:
+        """ The (1-indexed) number of the hit ending at `cursor` (i.e. selected), if known """
+        (ranges, starts, ends, _) = self._held
+        i = bisect_left(ends, cursor)
+        if self._occurrences is None or i == len(ends) or ends[i] != cursor:
+            return None
+        line = ranges[i][0]
+        on_line_before = i - bisect_left(starts, (line, 0))
+        return bisect_left(self._occurrences, line) + on_line_before + 1
+
+    def summary(self, cursor: Optional[tuple[int, int]]) -> str:
+        """ e.g. "3/120" when a hit is selected, else "120 found" """
+        position = None if cursor is None else self.position(cursor)
+        return f"{self.matches} found" if position is None else f"{position}/{self.matches}"
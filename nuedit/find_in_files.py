@@ -0,0 +1,175 @@
+"""Find in files: searches the files of a project tree in parallel, streaming the hits.
+
+The paths come from a FileIndex (so `.gitignore`d files are skipped, and the paths are cached), and
+are searched in batches by a process pool: each worker gets the compiled query (in its initializer),
+reads the files with mmap and skips binary files (a NUL byte in the first BINARY_SNIFF bytes). The
+hits of each batch are published as soon as it's searched, and only a few batches per worker are
+queued at a time, so cancelling stops the search within a batch.
+"""
+from __future__ import annotations
+import logging
+import mmap
+import multiprocessing as mp
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from time import sleep
+from typing import Callable, Iterator, NamedTuple, Optional, Union
+
+from .file_index import FileIndex
+
+BATCH = 64  # files per task (the first tasks are smaller, for a quick first hit)
+BINARY_SNIFF = 8192  # bytes checked for a NUL byte
+MAX_HITS_PER_FILE = 100
+MAX_LINE = 200  # characters of the hit line kept (around the hit)
+START_METHOD = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'  # of the workers
+
+
+class Hit(NamedTuple):
+    path: str  # relative to the root of the index
+    line: int  # 0-indexed
+    col: int  # byte offset in the line (UTF-8), like Xi's columns
+    text: str  # the line around the hit (at most MAX_LINE characters)
+
+
+# The query of the worker process, set once by `_init`:
+_pattern: Optional[re.Pattern] = None
+
+
+def _init(pattern: re.Pattern) -> None:
+    global _pattern
+    _pattern = pattern
+
+
+def _search_files(root: str, paths: list[str]) -> tuple[int, int, list[Hit]]:
+    """ (files searched, bytes searched, hits) of the files `paths` (relative to `root`), in a worker """
+    searched = 0
+    hits: list[Hit] = []
+    for path in paths:
+        try:
+            with open(os.path.join(root, path), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size:  # can't mmap an empty file
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                        hits.extend(_search(path, data))
+                searched += size
+        except (OSError, ValueError) as e:
+            logging.debug("[FindInFiles] Can't search %s: %s", path, e)
+    return (len(paths), searched, hits)
+
+
+def _search(path: str, data: mmap.mmap) -> Iterator[Hit]:
+    assert _pattern is not None
+    if data.find(b'\0', 0, BINARY_SNIFF) != -1:
+        return
+    # A str pattern (see `compile_query`) searches the decoded text:
+    text: Union[mmap.mmap, str] = data[:].decode('utf-8', 'replace') if isinstance(_pattern.pattern, str) else data
+    newline = '\n' if isinstance(text, str) else b'\n'
+    (line, counted) = (0, 0)  # newlines before offset `counted`
+    for (i, match) in enumerate(_pattern.finditer(text)):  # type: ignore
+        if i == MAX_HITS_PER_FILE:
+            break
+        start = match.start()
+        line += text[counted:start].count(newline)  # type: ignore
+        counted = start
+        line_start = text.rfind(newline, 0, start) + 1  # type: ignore
+        yield Hit(path, line, *_snippet(text, line_start, start, newline))
+
+
+def _snippet(text: Union[mmap.mmap, str], line_start: int, start: int, newline: Union[str, bytes]) -> tuple[int, str]:
+    """ (the byte column of `start`, up to MAX_LINE characters of its line around it) """
+    width = MAX_LINE if isinstance(text, str) else 4 * MAX_LINE  # (up to 4 bytes per character)
+    before = max(line_start, start - MAX_LINE // 2)  # (in bytes: at most MAX_LINE // 2 characters)
+    if isinstance(text, mmap.mmap):
+        while before < start and text[before] & 0xC0 == 0x80:  # not in the middle of a character
+            before += 1
+    end = text.find(newline, start, start + width)  # type: ignore
+    snippet = text[before:start + width if end == -1 else end]
+    if isinstance(snippet, bytes):
+        (col, snippet) = (start - line_start, snippet.decode('utf-8', 'replace'))
+    else:
+        col = len(text[line_start:start].encode('utf-8'))  # type: ignore
+    return (col, ('…' if before > line_start else '') + snippet[:MAX_LINE])
+
+
+def compile_query(query: str, regex: bool = False, case_sensitive: bool = False) -> re.Pattern:
+    """The pattern searched by the workers (raises re.error for an invalid regex).
+
+    Files are searched as bytes, except for case insensitive queries with non-ASCII characters: IGNORECASE
+    only folds ASCII in bytes patterns, so those search the decoded text (slower).
+    """
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    if not case_sensitive and not query.isascii():
+        return re.compile(query if regex else re.escape(query), flags)
+    pattern = query.encode('utf-8')
+    return re.compile(pattern if regex else re.escape(pattern), flags)
+
+
+class FindInFiles:
+    """Searches the files of `index` for `query` in a process pool (see above).
+
+    `hits` grows while searching, and `on_results` is called (from a background thread) whenever
+    it changes, and when the search is done.
+    """
+    def __init__(self, index: FileIndex, query: str, regex: bool = False, case_sensitive: bool = False,
+                 on_results: Callable[[], None] = lambda: None, workers: Optional[int] = None):
+        self.index = index
+        self.query = query
+        self.on_results = on_results
+        self.workers = workers or os.cpu_count() or 1
+        self.hits: list[Hit] = []
+        self.files_searched = 0
+        self.bytes_searched = 0
+        self.done = False
+        self._pattern = compile_query(query, regex, case_sensitive)  # raises re.error here rather than in the workers
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def _batches(self) -> Iterator[list[str]]:
+        """ The paths of the index in batches of 1, 2, 4... BATCH files, while the index is crawled """
+        paths = self.index.paths
+        (n, size) = (0, 1)
+        while not self._cancelled.is_set():
+            done = self.index.done  # (read before the paths)
+            while len(paths) - n >= size or (done and n < len(paths)):
+                yield paths[n:n + size]
+                (n, size) = (n + size, min(2 * size, BATCH))
+            if done and n >= len(paths):
+                return
+            sleep(0.01)  # wait for the crawl
+
+    def _run(self) -> None:
+        root = str(self.index.root)
+        # Not forked from this (threaded) process, where a child could inherit a lock held by another thread:
+        pool = ProcessPoolExecutor(self.workers, mp_context=mp.get_context(START_METHOD), initializer=_init, initargs=(self._pattern, ))
+        pending: set[Future] = set()
+        try:
+            for batch in self._batches():
+                pending.add(pool.submit(_search_files, root, batch))
+                if len(pending) >= 2 * self.workers:  # bounded, so cancelling is quick
+                    pending = self._collect(pending)
+            while pending and not self._cancelled.is_set():
+                pending = self._collect(pending)
+        except Exception:  # e.g. a broken pool
+            logging.exception("[FindInFiles] Searching %r failed", self.query)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.done = True
+            self.on_results()
+            logging.debug("[FindInFiles] %d hits for %r in %d files (%d bytes)%s", len(self.hits), self.query,
+                          self.files_searched, self.bytes_searched, " (cancelled)" if self._cancelled.is_set() else "")
+
+    def _collect(self, pending: set[Future]) -> set[Future]:
+        (done, pending) = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+        for future in done:
+            (files, searched, hits) = future.result()
+            self.files_searched += files
+            self.bytes_searched += searched
+            if hits:
+                self.hits.extend(hits)
+                self.on_results()
+        return pending
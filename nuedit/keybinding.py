@@ -5,13 +5,14 @@ from prompt_toolkit.key_binding import ConditionalKeyBindings, KeyBindings, merg
 from prompt_toolkit.filters import Condition
 
 import nuedit.actions as ACTIONS
+from .latency import LATENCY
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from .view import GlobalView
 
 
 def do_action(view: 'GlobalView', action: str, params: dict):
-    logging.debug(f"[Action] Calling {action}({params})")
+    logging.debug("[Action] Calling %s(%s)", action, params)
     result = getattr(ACTIONS, action)(params, view, view.rpc_channel)
     if type(result) == bool:
         # Actions usually returns None, but False indicate action
@@ -23,23 +24,24 @@ def do_action(view: 'GlobalView', action: str, params: dict):
 
 
 def get_view_kb(view: 'GlobalView'):
-    kb_map = view.shared_state['settings']['keybindings']
+    kb_map = view.state.settings['keybindings']
     rpc_channel = view.rpc_channel
 
     kb = KeyBindings()
 
     def do(key: str):
         if key not in kb_map:
-            logging.debug(f"[KB] Unknown special key: {key}")
+            logging.debug("[KB] Unknown special key: %s", key)
             return
 
         if kb_map[key][0] == '.':
             action = kb_map[key][1:]
             assert action[0] != '_'
             do_action(view, action, {})
-        else:
+        elif current_view := view.current_view:
             # params from config? Currently we just default to params always {}:
-            rpc_channel.edit(kb_map[key], {}, view.current_view.view_id)
+            LATENCY.input(current_view.view_id)
+            rpc_channel.edit(kb_map[key], {}, current_view.view_id)
 
     @kb.add('escape', '[', '1', ';', '4', 'A', eager=True)
     def c_s_up(_): do('c-s-up')
@@ -64,9 +66,23 @@ def get_view_kb(view: 'GlobalView'):
             if sequence.key in SPECIAL_KEYS:
                 do(sequence.key)
             else:
+                LATENCY.input(view.current_view.view_id)
                 rpc_channel.edit('insert', {'chars': sequence.key}, view.current_view.view_id)
 
-    return ConditionalKeyBindings(kb, filter=Condition(lambda: view.current_view is not None))
+    # While a large paste streams to Xi (see actions/copypaste.py), escape stops it and other keys are ignored:
+    kb_pasting = KeyBindings()
+
+    @kb_pasting.add('escape')
+    def cancel_paste(_):
+        if paste := view.current_view.paste:
+            paste.cancel()
+
+    pasting = Condition(lambda: view.current_view is not None and view.current_view.paste is not None)
+    # Not while typing in a toolbar (search, quick-open), keys go to its buffer then:
+    return merge_key_bindings([
+        ConditionalKeyBindings(kb, filter=Condition(lambda: view.current_view is not None and not view.app.layout.buffer_has_focus) & ~pasting),
+        ConditionalKeyBindings(kb_pasting, filter=pasting),
+    ])
 
 
 def test_keybindings():
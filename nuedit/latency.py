@@ -0,0 +1,188 @@
+"""Keystroke to paint latency, broken down by stage.
+
+Each key press sent to Xi is stamped (`perf_counter_ns`) and followed through the pipeline:
+
+    coalesce  key binding -> put on the rpc queue (held back by CoalescingChannel)
+    queue     rpc queue -> written to Xi by RpcController
+    xi        written -> the next `update` of the view is received
+    apply     received -> applied to the LineCache of the view
+    frame     applied -> rendered by the view (at most `max_fps` times a second)
+    paint     rendered -> drawn by prompt_toolkit (after_render)
+    total     key binding -> drawn
+
+The backend stamps when edits are written and when the update arrives, and passes the stamps
+along with the update (the clock is system wide, so this works across processes). Every stage keeps
+a log-bucketed histogram (p50/p95/p99), dumped with `LATENCY.dump()` (on SIGUSR1, see `log.py`)
+or printed on exit with `--profile-latency`. Recording a stamp is a few dict and list operations.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+from collections import deque
+from itertools import pairwise
+from time import perf_counter_ns
+from typing import Optional
+
+LATENCY_FILE = '/tmp/nuedit-latency-{pid}.json'
+STAGES = ('coalesce', 'queue', 'xi', 'apply', 'frame', 'paint')
+MAX_PENDING = 1024  # max stamps held per view (e.g. edits Xi never answers)
+
+Stamps = tuple[tuple[int, ...], int]  # (when the edits answered by an update were sent, when it was received)
+
+
+class Histogram:
+    """Durations (in ns) in log buckets: 8 buckets per power of two, so values are within 12.5%"""
+    SUB_BITS = 3
+
+    def __init__(self) -> None:
+        self.counts = [0] * (64 << self.SUB_BITS)
+        self.count = 0
+        self.max = 0
+
+    def add(self, ns: int) -> None:
+        ns = max(ns, 0)
+        self.counts[self._bucket(ns)] += 1
+        self.count += 1
+        self.max = max(self.max, ns)
+
+    @classmethod
+    def _bucket(cls, ns: int) -> int:
+        shift = ns.bit_length() - cls.SUB_BITS - 1
+        if shift <= 0:
+            return ns  # small values get a bucket each
+        return (shift << cls.SUB_BITS) + (ns >> shift)
+
+    @classmethod
+    def _upper(cls, bucket: int) -> int:
+        """ Upper bound (exclusive) of `bucket` """
+        shift = (bucket >> cls.SUB_BITS) - 1
+        if shift <= 0:
+            return bucket + 1
+        return ((bucket & ((1 << cls.SUB_BITS) - 1)) + (1 << cls.SUB_BITS) + 1) << shift
+
+    def percentile(self, p: float) -> int:
+        """ (Upper bound of) the `p`th percentile in ns """
+        rank = max(1, round(self.count * p / 100))
+        seen = 0
+        for (bucket, n) in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self._upper(bucket), self.max)
+        return self.max
+
+    def summary(self) -> dict[str, float]:
+        """ count, p50, p95, p99 and max (in ms) """
+        return {'count': self.count, **{f'p{p}': self.percentile(p) / 1e6 for p in (50, 95, 99)}, 'max': self.max / 1e6}
+
+
+class LatencyTracker:
+    """Follows key presses through the stages (see above), and keeps a Histogram of each stage"""
+    def __init__(self) -> None:
+        self.histograms = {stage: Histogram() for stage in (*STAGES, 'total')}
+        self._lock = threading.Lock()
+        # Frontend: per view, [input, queued] of the key presses not applied yet, then [input, ..., rendered] until painted
+        self._inputs: dict[str, deque[list[int]]] = {}
+        self._applied: dict[str, list[list[int]]] = {}
+        self._rendered: list[list[int]] = []
+        # Backend: per view, when the edits not answered (with an update) yet were written to Xi
+        self._sent: dict[str, deque[int]] = {}
+
+    def input(self, view_id: str) -> None:
+        """A key press is about to be sent to `view_id`"""
+        with self._lock:
+            if view_id not in self._inputs:
+                self._inputs[view_id] = deque(maxlen=MAX_PENDING)
+            self._inputs[view_id].append([perf_counter_ns(), 0])
+
+    def queued(self, view_id: str) -> None:
+        """The edits for `view_id` are about to be put on the rpc queue"""
+        if not self._inputs.get(view_id):
+            return
+        now = perf_counter_ns()
+        with self._lock:
+            for stamps in reversed(self._inputs[view_id]):
+                if stamps[1]:
+                    break
+                stamps[1] = now
+
+    def sent(self, view_ids: list[str]) -> None:
+        """(Backend) Edits for `view_ids` were written to Xi"""
+        now = perf_counter_ns()
+        with self._lock:
+            for view_id in view_ids:
+                if view_id not in self._sent:
+                    self._sent[view_id] = deque(maxlen=MAX_PENDING)
+                self._sent[view_id].append(now)
+
+    def received(self, view_id: str) -> Stamps:
+        """(Backend) An update of `view_id` was received, returns the stamps passed on to `applied`"""
+        now = perf_counter_ns()
+        with self._lock:
+            return (tuple(self._sent.pop(view_id, ())), now)
+
+    def applied(self, view_id: str, stamps: Optional[Stamps]) -> None:
+        """The update (with `stamps`) was applied: the key presses sent before it was received are done"""
+        if not stamps or not stamps[0] or not self._inputs.get(view_id):
+            return
+        (sends, received) = stamps
+        now = perf_counter_ns()
+        with self._lock:
+            inputs = self._inputs[view_id]
+            while inputs and 0 < inputs[0][1] <= sends[-1]:
+                (t_input, t_queued) = inputs.popleft()
+                t_sent = next(t for t in sends if t >= t_queued)
+                self._applied.setdefault(view_id, []).append([t_input, t_queued, t_sent, received, now])
+
+    def rendered(self, view_id: str) -> None:
+        """The view was rendered (with the applied updates)"""
+        if view_id not in self._applied:
+            return
+        now = perf_counter_ns()
+        with self._lock:
+            for stamps in self._applied.pop(view_id, []):
+                stamps.append(now)
+                self._rendered.append(stamps)
+
+    def painted(self, _app=None) -> None:
+        """prompt_toolkit drew the screen (an `after_render` handler)"""
+        if not self._rendered:
+            return
+        now = perf_counter_ns()
+        with self._lock:
+            (rendered, self._rendered) = (self._rendered, [])
+            for stamps in rendered:
+                stamps.append(now)
+                for (stage, (start, end)) in zip(STAGES, pairwise(stamps)):
+                    self.histograms[stage].add(end - start)
+                self.histograms['total'].add(now - stamps[0])
+
+    def forget(self, view_id: str) -> None:
+        """ Drop the stamps of a closed view """
+        with self._lock:
+            self._inputs.pop(view_id, None)
+            self._applied.pop(view_id, None)
+            self._sent.pop(view_id, None)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {stage: hist.summary() for (stage, hist) in self.histograms.items()}
+
+    def report(self) -> str:
+        lines = [f"{'stage':8}  {'count':>6}  {'p50':>8}  {'p95':>8}  {'p99':>8}  {'max':>8}  (ms)"]
+        for (stage, s) in self.summary().items():
+            lines.append(f"{stage:8}  {s['count']:6}  {s['p50']:8.2f}  {s['p95']:8.2f}  {s['p99']:8.2f}  {s['max']:8.2f}")
+        return '\n'.join(lines)
+
+    def dump(self, path: Optional[str] = None) -> str:
+        """ Write the summary and the (non-empty) buckets of each stage as JSON, returns the path """
+        path = path or LATENCY_FILE.format(pid=os.getpid())
+        with self._lock:
+            buckets = {stage: {Histogram._upper(b): n for (b, n) in enumerate(hist.counts) if n}
+                       for (stage, hist) in self.histograms.items()}
+        with open(path, 'w') as f:
+            json.dump({'summary': self.summary(), 'buckets_ns': buckets}, f, indent=2)
+        return path
+
+
+LATENCY = LatencyTracker()
@@ -5,16 +5,11 @@ from functools import partial
 
 # from prompt_toolkit import ANSI('\x1b[31mhello \x1b[32mworld')
 from prompt_toolkit.formatted_text import FormattedText  #, HTML('<u>underline</u>')
-from prompt_toolkit.mouse_events import MouseEvent, MouseEventType
-
-from collections import namedtuple
-FormattedLetter = namedtuple('FormattedLetter', ['style', 'letter', 'mouse_handler'])
-
-
-def add_style(inst: FormattedLetter, style: str) -> FormattedLetter:
-    return inst._replace(style=" ".join([inst.style, style]))
+from prompt_toolkit.mouse_events import MouseButton, MouseEvent, MouseEventType
 
+from .spans import AnnotationIndex, cursor_spans, line_fragments, style_spans
 
+from collections import namedtuple
 ClickInfo = namedtuple('ClickInfo', ['xy', 'count'])
 last_click = ClickInfo((-1, -1), 0)
 
@@ -54,10 +49,17 @@ def mouse_handler(sview, xy: tuple, mouse_event: MouseEvent) -> None:
                 'ty': {'select_extend': {'granularity': 'point', 'multi': False}}
             }, sview.view_id)
             last_click = ClickInfo(xy, 1)
+    elif mouse_event.event_type == MouseEventType.MOUSE_MOVE and mouse_event.button != MouseButton.NONE:
+        # Dragging (only the latest position per frame is sent, see CoalescingChannel):
+        rpc_channel.edit('gesture', {
+            'col': xy[0],
+            'line': xy[1],
+            'ty': {'select_extend': {'granularity': 'point', 'multi': False}}
+        }, sview.view_id)
     elif mouse_event.event_type == MouseEventType.SCROLL_UP:
-        pass
+        sview.scroll_by(-sview.SCROLL_LINES)
     elif mouse_event.event_type == MouseEventType.SCROLL_DOWN:
-        pass
+        sview.scroll_by(sview.SCROLL_LINES)
 
 
 class Line:
@@ -73,48 +75,28 @@ class Line:
         for k in kwargs.keys():
             assert hasattr(self, k), f'Unknown line property: {k}'
 
-    def get_formatted(self, annotations: list, shared_styles: dict, sview):
-        output = [
-            FormattedLetter("", char, partial(mouse_handler, sview, (col+1, self.ln-1)))
-            for col, char in enumerate(self.text)]
-
-        # Add style
-        n_styles = len(self.styles)
-        last_end = 0
-        for i in range(n_styles // 3):
-            start_idx = self.styles[i] + last_end
-            style_len = self.styles[i + 1]
-            last_end = start_idx + style_len
-            style_id = self.styles[i + 2]
-            for j in range(start_idx, style_len):
-                output[j] = add_style(output[j], shared_styles[style_id])
-
-        # Add annotation
-        for annotation in annotations:
-            assert len(annotation['ranges']) == annotation['n'], f"Bad annotation: {annotation}"
-            style = shared_styles[annotation['type']]
+    def get_formatted(self, annotations: AnnotationIndex, shared_styles: dict, sview):
+        # One mouse handler for the whole line (the column is read from the mouse event):
+        handler = partial(_line_mouse_handler, sview, self.ln - 1)
+        return [(style, text, handler) for (style, text, *_) in line_fragments(self.text, [
+            *style_spans(self.styles, shared_styles),
+            *annotations.spans(self.ln - 1, shared_styles),  # self.ln is 1 indexed
+            *cursor_spans(self.cursor, shared_styles['cursor']),
+        ])]
 
-            for (start_line, start_col, end_line, end_col) in annotation['ranges']:
 
-                # self.ln is 1 indexed:
-                if start_line <= self.ln - 1 <= end_line:
-                    # logging.debug(f"self.ln-1={self.ln-1}, {start_line=}, {start_col=}, {end_line=}, {end_col=}")
-                    start_idx = start_col if start_line == self.ln - 1 else 0
-                    end_idx   = end_col   if end_line   == self.ln - 1 else len(output)
-                    for i in range(start_idx, end_idx):
-                        output[i] = add_style(output[i], style)
+def _line_mouse_handler(sview, line: int, mouse_event: MouseEvent) -> None:
+    mouse_handler(sview, (mouse_event.position.x + 1, line), mouse_event)
 
-        # Add cursors
-        for cursor in self.cursor:
-            output[cursor] = add_style(output[cursor], shared_styles['cursor'])
 
-        return output
+INVALID_LINE = Line(valid=False)
 
 
 class Lines(list):
     def __init__(self, shared_styles=dict, *args):
         super(Lines, self).__init__(*args)
         self.annotations = []
+        self.annotation_index = AnnotationIndex()
         self.shared_styles = shared_styles
         # TODO: speedup using deque?
 
@@ -124,6 +106,7 @@ class Lines(list):
         """
         new_lines = Lines(shared_styles=self.shared_styles)
         new_lines.annotations = update['annotations']
+        new_lines.annotation_index = AnnotationIndex(update['annotations'])
 
         old_idx = 0
         for op in update['ops']:
@@ -140,9 +123,9 @@ class Lines(list):
                 old_idx += n
 
             elif op['op'] == 'invalidate':
-                # TODO: logic below is "correct", but very slow for big files (n big)
-                for _ in range(n):
-                    new_lines.append(Line(valid=False))
+                # Invalid lines are never mutated, so they can share a single instance
+                # (still O(n), see LineCache for the O(1) version):
+                new_lines.extend([INVALID_LINE] * n)
 
             elif op['op'] == 'ins':
                 assert len(op['lines']) == n
@@ -180,14 +163,13 @@ class Lines(list):
 
     def get_formatted(self, sview):
         output = []  # https://python-prompt-toolkit.readthedocs.io/en/master/pages/printing_text.html#style-text-tuples
-        line_no = ""
-        len_of_lineno_col = 0
+        line_numbers = []
         for line in filter(lambda l: l.valid, self):  # and line.ln >= topline
-            output += line.get_formatted(self.annotations, self.shared_styles, sview)
-            line_no += str(line.ln) + '\n'
-            len_of_lineno_col = line.ln
+            output += line.get_formatted(self.annotation_index, self.shared_styles, sview)
+            line_numbers.append(str(line.ln))
 
-        len_of_lineno_col = len(str(len_of_lineno_col))
-        line_no = '\n'.join(row.rjust(len_of_lineno_col, ' ') for row in line_no.split('\n'))
+        len_of_lineno_col = len(line_numbers[-1]) if line_numbers else 1
+        line_numbers.append('')  # trailing empty row
+        line_no = '\n'.join(row.rjust(len_of_lineno_col, ' ') for row in line_numbers)
 
         return FormattedText(output), line_no, len_of_lineno_col
@@ -1,14 +1,17 @@
 from __future__ import annotations
+from bisect import bisect_right
 from collections import deque
+from itertools import repeat
 import logging
-from multiprocessing.managers import DictProxy
 from typing import Any, Iterator, Literal, Optional, Tuple, TypedDict
 # from collections import deque
 
 # from prompt_toolkit import ANSI('\x1b[31mhello \x1b[32mworld')
+from prompt_toolkit.formatted_text import StyleAndTextTuples
 from prompt_toolkit.layout.containers import Container, Window
 #from prompt_toolkit.mouse_events import MouseEvent, MouseEventType
 from .keybinding import get_view_kb
+from .spans import AnnotationIndex, FragmentCache, cursor_spans, line_fragments, style_spans
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -27,76 +30,84 @@ class SingleLine:
         self.cursor = cursor
         self.styles = styles
 
-    def get_style_text_pairs(self, annotations: AnnotationSet) -> Iterator[Tuple[str, str]]:
-        """ Returns (style, text) pairs """
-        logging.debug(f"get_style_text_pairs: {self.cursor=} {self.styles=} {self.text=}")
-
-        # pass from global
-        shared_state = {'styles': {
-            'cursor': 'reverse underline',
-            0: 'reverse',
-            1: 'fg:ansiyellow bg:black',
-        }}
-
-        # Idé: lav par af (start, end, type) pairs og iter over zip()
-        #pairs: list[Tuple[int, int, str]] = []  # (start, length, style)
-        dumb_poc = {}
-
-        # Add style:
-        n_styles = len(self.styles)
-        last_end = 0
-        for i in range(n_styles // 3):
-            start_idx = self.styles[i] + last_end
-            style_len = self.styles[i + 1]
-            style_id = self.styles[i + 2]
-            last_end = start_idx + style_len
-            #pairs.append((start_idx, style_len, shared_state['styles'][style_id]))
-            for asd in range(style_len): dumb_poc[start_idx+asd] = shared_state['styles'][style_id]
-
-        for ann in annotations:
-            ...
-
-        for cursor in self.cursor:
-            #pairs.append((cursor, 1, shared_state['styles']['cursor']))
-            dumb_poc[cursor] = shared_state['styles']['cursor']
-
-        # Keep track of overlapping styles
-        # E.g. [text [selected[cursor]___] ]
-        #applied_styles = []
-        #while len(pairs) > 1:
-        #    (start_idx, style_len, style) = pairs.pop(0)
-        #assert len(pairs) == 1
-        #(start_idx, style_len, style) = pairs.pop()
-        #yield (style, self.text[start_idx:])  # todo: apply other styles
-
-        for i, c in enumerate(self.text):
-            yield (dumb_poc.get(i, ''), c)
-
-        # Dette virker:
-        # txt_style = ''  # '#44ff00 italic'
-        # if len(self.cursor) == 0:
-        #     yield (txt_style, self.text)
-        # else:
-        #     pos = 0
-        #     for cursor in self.cursor:
-        #         yield (txt_style, self.text[pos:cursor])
-        #         yield (cursor_style, self.text[cursor:cursor+1])
-        #         pos = cursor + 1
-        #     yield (txt_style, self.text[pos:])
+    def get_style_text_pairs(self, annotations: AnnotationIndex, styles: dict, cache: Optional[FragmentCache] = None) -> StyleAndTextTuples:
+        """ Returns the fewest (style, text) pairs for this line (looked up in `cache` if given) """
+        logging.debug("get_style_text_pairs: cursor=%s styles=%s text=%r", self.cursor, self.styles, self.text)
+        # Layered: syntax styles < annotations (selection, find) < cursors
+        spans = [
+            *style_spans(self.styles, styles),
+            *annotations.spans(self.ln - 1, styles),
+            *cursor_spans(self.cursor, styles['cursor']),
+        ]
+        return cache.fragments(self.text, spans) if cache is not None else line_fragments(self.text, spans)
 
     @property
     def is_wrapped(self):
         return False  # todo
 
+class Run:
+    """A run of lines in the LineCache: valid lines `lines[start:stop]` (numbered from `ln`),
+    or `stop - start` invalid lines if `lines` is None. Runs are views, so copying lines is O(1)"""
+    __slots__ = ('lines', 'start', 'stop', 'ln')
+
+    def __init__(self, lines: Optional[list[SingleLine]], start: int, stop: int, ln: int = 0) -> None:
+        self.lines = lines
+        self.start = start
+        self.stop = stop
+        self.ln = ln  # line number of lines[start]
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __repr__(self) -> str:
+        return f"Run({'valid' if self.lines is not None else 'invalid'} n={len(self)} ln={self.ln})"
+
+    def slice(self, offset: int, n: int) -> Run:
+        return Run(self.lines, self.start + offset, self.start + offset + n, self.ln + offset)
+
+
+class _RunReader:
+    """Reads the runs of the previous state front to back (the copy/skip/update ops only move forward)"""
+    def __init__(self, runs: list[Run]):
+        self.runs = runs
+        self.idx = 0     # current run
+        self.offset = 0  # lines consumed of the current run
+
+    def take(self, n: int) -> Iterator[Run]:
+        """ Yields (slices of) runs with the next `n` lines (fewer at the end of the document) """
+        while n > 0 and self.idx < len(self.runs):
+            run = self.runs[self.idx]
+            k = min(n, len(run) - self.offset)
+            yield run.slice(self.offset, k)
+            n -= k
+            self.offset += k
+            if self.offset == len(run):
+                self.idx += 1
+                self.offset = 0
+
+    def skip(self, n: int) -> None:
+        for _ in self.take(n):
+            pass
+
+
 class LineCache:
+    """The lines of a view, as a list of runs of valid lines and invalid gaps.
+
+    Applying an update is O(ops + lines inserted/updated), independent of the document length,
+    and memory is proportional to the valid lines held.
+    """
     def __init__(self, global_view: 'GlobalView'):
         self.annotations: list[AnnotationSet] = []
+        self.annotation_index = AnnotationIndex()
         self.global_view = global_view
-        self.shared_styles: DictProxy[str, Any] = global_view.shared_state['styles']
+        self.styles = global_view.state.styles
+        self.fragment_cache = FragmentCache(global_view.state.settings.get('fragment_cache_size', 4096))
 
-        self.invalid_before = 0
-        self.invalid_after = 0
-        self.lines: list[Optional[SingleLine]] = []  # deque() ?
+        self.runs: list[Run] = []
+        self._offsets: list[int] = []  # index of the first line of each run
+        self._len = 0
+        self.max_ln = 0  # highest line number (used to calculate the size of "line no" col)
+        self.version = 0  # incremented on every update
 
     def apply_update(self, update: dict) -> None:
         """Apply 'update' and return result (self+update)
@@ -104,87 +115,146 @@ class LineCache:
         TODO: typeddict from https://xi-editor.io/xi-editor/docs/frontend-protocol.html#update <-- struct
         """
         self.annotations = update['annotations']
+        self.annotation_index = AnnotationIndex(self.annotations)
 
-        index = 0
-        new_lines: list[Optional[SingleLine]] = []
-        new_invalid_before = 0
-        new_invalid_after = 0
+        old = _RunReader(self.runs)
+        new_runs: list[Run] = []
 
         for op in update['ops']:
             n = op['n']  # lines affected
 
             if op['op'] == 'copy':
-                if index < self.invalid_before:
-                    invalid = min(n, self.invalid_before - index)
-                    new_invalid_before, new_invalid_after = self._add_invalid(new_lines, new_invalid_before, new_invalid_after, invalid)
-                    n -= invalid
-                    index += invalid
-                number = op["ln"]
-                if n > 0 and index < self.invalid_before + len(self.lines):
-                    line = self.lines[index - self.invalid_before]
-                    if line == None or line.is_wrapped:  # type: ignore
-                        number += 1
-                while n > 0 and index < self.invalid_before + len(self.lines):
-                    line = self.lines[index - self.invalid_before]
-                    if line and not line.is_wrapped:
-                        line.ln = number
-                        number += 1
-                    new_invalid_before, new_invalid_after = self._add_line(new_lines, new_invalid_before, new_invalid_after, line)
-                    n -= 1
-                    index += 1
-                new_invalid_before, new_invalid_after = self._add_invalid(new_lines, new_invalid_before, new_invalid_after, n)
-                index += n
+                number = op['ln']
+                for run in old.take(n):
+                    run.ln = number  # renumber the copied lines
+                    number += len(run)
+                    n -= len(run)
+                    self._add_run(new_runs, run)
+                self._add_run(new_runs, Run(None, 0, n))  # copied past the end of the old lines
             elif op['op'] == 'skip':
-                index += n
+                old.skip(n)
             elif op['op'] == 'invalidate':
-                new_invalid_before, new_invalid_after = self._add_invalid(new_lines, new_invalid_before, new_invalid_after, n)
+                self._add_run(new_runs, Run(None, 0, n))
             elif op['op'] == 'ins':
-                for json_line in op["lines"]:
-                    line = SingleLine(**json_line)
-                    new_invalid_before, new_invalid_after = self._add_line(new_lines, new_invalid_before, new_invalid_after, line)
+                lines = [SingleLine(**json_line) for json_line in op['lines']]
+                self._add_run(new_runs, Run(lines, 0, len(lines), lines[0].ln if lines else 0))
             elif op['op'] == 'update':
-                for json_line in op["lines"]:
-                    if line := self.lines[index - self.invalid_before]:
+                json_lines = iter(op['lines'])
+                for run in old.take(n):
+                    if run.lines is None:
+                        for _ in range(len(run)):
+                            next(json_lines)
+                        self._add_run(new_runs, run)
+                        continue
+                    lines = run.lines[run.start:run.stop]
+                    for k, line in enumerate(lines):
+                        json_line = next(json_lines)
+                        line.ln = run.ln + k  # unless updated below
                         for prop in json_line:
                             assert hasattr(line, prop), f'Line does not have {prop=} ({json_line=})'
                             setattr(line, prop, json_line[prop])
-                    new_invalid_before, new_invalid_after = self._add_line(new_lines, new_invalid_before, new_invalid_after, line)
-                    index += 1
+                    self._add_run(new_runs, Run(lines, 0, len(lines), lines[0].ln))
             else:
-                logging.warning(f'Lines not implemented: {op}({update})')
+                logging.warning('Lines not implemented: %s(%s)', op, update)
+
+        self._compact(new_runs)
+        offsets = []
+        total = 0
+        max_ln = 0
+        for run in new_runs:
+            offsets.append(total)
+            total += len(run)
+            if run.lines is not None:
+                max_ln = max(max_ln, run.ln + len(run) - 1)
 
         # Save new state
-        self.lines = new_lines
-        self.invalid_after = new_invalid_after
-        self.invalid_before = new_invalid_before
-
-    def _add_line(self, lines: list[Optional[SingleLine]], invalid_before: int, invalid_after: int, line: Optional[SingleLine]) -> Tuple[int, int]:
-        if line is None:
-            return self._add_invalid(lines, invalid_before, invalid_after, 1)
-
-        lines.extend([None]*invalid_after)
-        invalid_after = 0
-        lines.append(line)
-        return invalid_before, invalid_after
-
-    def _add_invalid(self, lines: list[Optional[SingleLine]], invalid_before: int, invalid_after: int, n: int) -> Tuple[int, int]:
-        if len(lines) == 0:
-            invalid_before += n
-        else:
-            invalid_after += n
-        return invalid_before, invalid_after
+        self.runs, self._offsets, self._len, self.max_ln = new_runs, offsets, total, max_ln
+        self.version += 1
+
+    @staticmethod
+    def _add_run(runs: list[Run], run: Run) -> None:
+        if len(run) == 0:
+            return
+        if runs:
+            last = runs[-1]
+            if last.lines is None and run.lines is None:
+                last.stop += len(run)  # merge invalid gaps
+                return
+            if last.lines is run.lines and last.stop == run.start and last.ln + len(last) == run.ln:
+                last.stop = run.stop  # continuous view of the same lines
+                return
+        runs.append(run)
+
+    @staticmethod
+    def _compact(runs: list[Run]) -> None:
+        """Copy runs out of lists that are mostly unreferenced, so memory stays proportional to the valid lines held"""
+        held: dict[int, int] = {}
+        for run in runs:
+            if run.lines is not None:
+                held[id(run.lines)] = held.get(id(run.lines), 0) + len(run)
+        for run in runs:
+            if run.lines is not None and held[id(run.lines)] * 2 < len(run.lines):
+                (run.lines, run.start, run.stop) = (run.lines[run.start:run.stop], 0, len(run))
+
+    def __len__(self) -> int:
+        """ Number of lines in the document (valid or not) """
+        return self._len
+
+    def _run_at(self, i: int) -> int:
+        return bisect_right(self._offsets, i) - 1
+
+    def get(self, i: int) -> Optional[SingleLine]:
+        """ Line `i` (None if invalid) """
+        if not 0 <= i < self._len:
+            return None
+        r = self._run_at(i)
+        run = self.runs[r]
+        if run.lines is None:
+            return None
+        line = run.lines[run.start + i - self._offsets[r]]
+        line.ln = run.ln + i - self._offsets[r]
+        return line
+
+    def visible(self, first: int, last: int) -> Iterator[Optional[SingleLine]]:
+        """ Lines [first, last) (None if invalid) """
+        first = max(first, 0)
+        last = min(last, self._len)
+        if first >= last:
+            return
+        r = self._run_at(first)
+        i = first
+        while i < last:
+            run, offset = self.runs[r], i - self._offsets[r]
+            k = min(len(run) - offset, last - i)
+            if run.lines is None:
+                yield from repeat(None, k)
+            else:
+                for j in range(offset, offset + k):
+                    line = run.lines[run.start + j]
+                    line.ln = run.ln + j
+                    yield line
+            i += k
+            r += 1
 
     @property
-    def max_ln(self) -> int:
-        """ Used to calculate the size of "line no" col """
-        return max([l.ln for l in self.lines if l])
+    def lines(self) -> Iterator[SingleLine]:
+        """ All valid lines """
+        for run in self.runs:
+            if run.lines is not None:
+                for j in range(len(run)):
+                    line = run.lines[run.start + j]
+                    line.ln = run.ln + j
+                    yield line
+
+    def render(self, line: SingleLine) -> StyleAndTextTuples:
+        """ Returns the (cached) (style, text) pairs of `line` """
+        return line.get_style_text_pairs(self.annotation_index, self.styles, self.fragment_cache)
 
     @property
     def cursors(self):
         for line in self.lines:
-            if line:
-                for cursor in line.cursor:
-                    yield (line.ln - 1, cursor)
+            for cursor in line.cursor:
+                yield (line.ln - 1, cursor)
 
     @property
     def has_selection(self):
@@ -0,0 +1,134 @@
+"""Logging for NuEdit.
+
+Log records are handed to a background thread (a `QueueListener`) which formats and writes them,
+so the render and RPC threads never wait for file I/O. The level is set with `log_level` in
+settings.yaml or the `NUEDIT_LOG_LEVEL` environment variable (which takes precedence).
+
+`TRACE` keeps the last raw RPC messages in memory. It is dumped on crash, or on demand by
+sending SIGUSR1 to the process (`kill -USR1 <pid>`).
+
+`STARTUP` records when each step of the startup finished (printed with `--profile-startup`).
+The keystroke latency histograms (`nuedit.latency`) are dumped with the RPC trace on SIGUSR1.
+"""
+import atexit
+import copy
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+from collections import deque
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from time import perf_counter, time
+from typing import Optional
+
+from .latency import LATENCY
+
+LOG_FILE = '/tmp/nuedit.log'
+TRACE_FILE = '/tmp/nuedit-rpc-trace-{pid}.log'
+DEFAULT_LEVEL = 'WARNING'
+FORMAT = '[%(asctime)s] %(name)s - %(levelname)s - %(message)s'
+_FORMATTER = logging.Formatter(FORMAT)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message (and traceback) now, as the args may be changed before the listener formats the record,
+        # but leave the rest of the formatting (the timestamp etc.) to the listener:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or _FORMATTER.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RpcTrace:
+    """Ring buffer with the last `maxlen` raw messages sent to (>) and received from (<) Xi"""
+    def __init__(self, maxlen: int = 1000):
+        self.messages: deque[tuple[float, str, bytes]] = deque(maxlen=maxlen)
+
+    def resize(self, maxlen: int) -> None:
+        self.messages = deque(self.messages, maxlen=maxlen)
+
+    def record(self, direction: str, raw: bytes) -> None:
+        self.messages.append((time(), direction, raw))
+
+    def dump(self, path: Optional[str] = None) -> str:
+        path = path or TRACE_FILE.format(pid=os.getpid())
+        with open(path, 'w') as f:
+            for (timestamp, direction, raw) in list(self.messages):
+                f.write(f"{datetime.fromtimestamp(timestamp).isoformat()} {direction} {raw.decode(errors='replace').rstrip()}\n")
+        return path
+
+
+class StartupProfile:
+    """Time of each step of the startup, relative to when this module was imported (only the first mark of a step counts)"""
+    def __init__(self) -> None:
+        self.start = perf_counter()
+        self.steps: dict[str, float] = {}
+
+    def mark(self, step: str) -> None:
+        if step not in self.steps:
+            self.steps[step] = perf_counter() - self.start
+            logging.debug("[Startup] %s after %.1fms", step, self.steps[step] * 1e3)
+
+    def report(self) -> str:
+        width = max(map(len, self.steps), default=0)
+        return '\n'.join(f"{step.ljust(width)}  {elapsed * 1e3:8.1f} ms" for (step, elapsed) in self.steps.items())
+
+
+TRACE = RpcTrace()
+STARTUP = StartupProfile()
+_listener: Optional[QueueListener] = None
+_hooks_installed = False
+
+
+def setup(level: Optional[str] = None, filename: str = LOG_FILE, filemode: str = 'w') -> None:
+    """(Re)configure logging for this process. Must be called again in a forked process, as the listener thread isn't inherited"""
+    global _listener, _hooks_installed
+    stop()
+    handler = logging.FileHandler(filename, filemode)
+    handler.setFormatter(_FORMATTER)
+    records: queue.SimpleQueue = queue.SimpleQueue()
+
+    root = logging.getLogger()
+    root.handlers = [_QueueHandler(records)]
+    set_level(level)
+
+    _listener = QueueListener(records, handler)
+    _listener.start()
+    atexit.register(stop)
+
+    if not _hooks_installed:
+        sys.excepthook = _excepthook(sys.excepthook)
+        threading.excepthook = _excepthook(threading.excepthook)  # type: ignore
+        _hooks_installed = True
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, _dump)
+
+
+def set_level(level: Optional[str] = None) -> None:
+    logging.getLogger().setLevel(os.environ.get('NUEDIT_LOG_LEVEL', level or DEFAULT_LEVEL).upper())
+
+
+def stop() -> None:
+    """ Flush pending log records and stop the listener (blocking) """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _dump(signum, frame) -> None:
+    logging.warning(f"[Log] RPC trace dumped to {TRACE.dump()}, latency to {LATENCY.dump()}")
+
+
+def _excepthook(hook):
+    def dump_trace(*args):
+        logging.critical(f"[Log] Crashed, RPC trace dumped to {TRACE.dump()}")
+        hook(*args)
+    return dump_trace
@@ -1,7 +1,18 @@
-from .search import SearchToolbar
 from .toolbar import Toolbar
 
 __all__ = [
     'Toolbar',
     'SearchToolbar',
+    'QuickOpenToolbar',
 ]
+
+
+def __getattr__(name: str):
+    # The search and quick-open toolbars are only imported when first used:
+    if name == 'SearchToolbar':
+        from .search import SearchToolbar
+        return SearchToolbar
+    if name == 'QuickOpenToolbar':
+        from .quick_open import QuickOpenToolbar
+        return QuickOpenToolbar
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,101 @@
+import logging
+import os
+
+from prompt_toolkit.buffer import Buffer
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.key_binding.key_bindings import KeyBindings
+from prompt_toolkit.layout.containers import ConditionalContainer, HSplit, VSplit, Window
+from prompt_toolkit.layout.controls import BufferControl, FormattedTextControl
+from prompt_toolkit.layout.processors import BeforeInput
+from prompt_toolkit.filters import Condition
+
+from ..file_index import FuzzyMatcher
+from .toolbar import Toolbar
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from ..view import GlobalView
+
+
+class QuickOpenToolbar(Toolbar):
+    """Fuzzy finds a file of the project (see `nuedit.file_index`) and opens it in a new view"""
+    HEIGHT = 10  # results shown
+
+    def __init__(self, view: 'GlobalView'):
+        super(QuickOpenToolbar, self).__init__(view)
+        self.index = view.file_index
+        self.matcher = FuzzyMatcher(self.index, on_results=lambda: view.app.invalidate())
+        self._selected = 0
+
+        self.control = BufferControl(
+            focus_on_click=True,
+            key_bindings=self._get_kb(),
+            include_default_input_processors=False,
+            input_processors=[BeforeInput("Open: ", style="bold bg:#3200ff")],
+            buffer=Buffer(
+                multiline=False,
+                accept_handler=self.handler,
+                on_text_changed=lambda buffer: self._search(buffer.text),
+            )
+        )
+        self.container = HSplit([
+            ConditionalContainer(
+                Window(FormattedTextControl(self._get_results), height=lambda: min(len(self.matcher.results), self.HEIGHT)),
+                filter=Condition(lambda: len(self.matcher.results) > 0)),
+            VSplit([
+                Window(content=self.control),
+                Window(FormattedTextControl(text=self._get_status), width=lambda: len(self._get_status()), style='fg:#888'),
+            ], height=1, style='bg:#3200ff'),
+        ])
+        self._search('')
+
+    def __pt_container__(self):
+        return self.container
+
+    def _search(self, query: str) -> None:
+        self._selected = 0
+        self.matcher.search(query)
+
+    def _get_status(self) -> str:
+        return "{found} of {files} files{indexing}{searching}".format(
+            found=len(self.matcher.results),
+            files=len(self.index.paths),
+            indexing='' if self.index.done else ' (indexing...)',
+            searching='' if self.matcher.done else ' (searching...)',
+        )
+
+    def _get_results(self) -> StyleAndTextTuples:
+        results = self.matcher.results[:self.HEIGHT]
+        return [('reverse' if i == self._selected else '', f"{path}\n") for (i, path) in enumerate(results)]
+
+    def handler(self, buffer: Buffer):
+        results = self.matcher.results
+        if not results:
+            return True  # <-- keep text
+        path = os.path.relpath(self.index.root / results[min(self._selected, len(results) - 1)])
+        logging.debug("[QuickOpen] Opening %s", path)
+        self._close()
+        self.view.new_view(path)
+        return False  # <-- delete text
+
+    def _close(self) -> None:
+        self.matcher.close()
+        self.view.toolbar = Toolbar(self.view)  # Hide "Open: " and fix focus:
+        if self.view.current_view or self.view.fileman_visible:
+            self.view.app.layout.focus((self.view.current_view or self.view.fileman).input_field)
+
+    def _get_kb(self):
+        kb = KeyBindings()
+
+        @kb.add('up')
+        def _(event):
+            self._selected = max(0, self._selected - 1)
+
+        @kb.add('down')
+        def _(event):
+            self._selected = min(min(len(self.matcher.results), self.HEIGHT) - 1, self._selected + 1)
+
+        @kb.add('escape')
+        def _(event):
+            self._close()
+
+        return kb
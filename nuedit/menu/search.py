@@ -1,8 +1,11 @@
 import logging
+import os
 import re
 
 from prompt_toolkit.buffer import Buffer
-from prompt_toolkit.layout.containers import Container, Window
+from prompt_toolkit.filters import Condition
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+from prompt_toolkit.layout.containers import ConditionalContainer, Container, HSplit, VSplit, Window
 from prompt_toolkit.layout.controls import BufferControl, FormattedTextControl
 from prompt_toolkit.key_binding import ConditionalKeyBindings
 from prompt_toolkit.key_binding.key_bindings import KeyBindings
@@ -16,21 +19,30 @@ from prompt_toolkit.layout.processors import (
 from .toolbar import Toolbar
 from typing import TYPE_CHECKING, Optional
 if TYPE_CHECKING:
+    from ..find_in_files import FindInFiles
     from ..view import View
 
 class SearchToolbar(Toolbar):
+    HEIGHT = 10  # find in files results shown
+
     def __init__(self, view: 'View'):
         super(SearchToolbar, self).__init__(view)
 
-        self._find_idx = 0
         self._last_search_str: Optional[str] = None
+        # Ctrl+F (again) searches the files of the file manager's directory (see nuedit/find_in_files.py):
+        self.in_files = view.current_view is None
+        self.search: Optional['FindInFiles'] = None
+        self._files_query: Optional[str] = None
+        self._selected = 0
+        # (cursor before, cursor after) the last jump selected directly, until Xi moves the cursor:
+        self._jumped: Optional[tuple[Optional[tuple[int, int]], tuple[int, int]]] = None
 
         self.control = BufferControl(
             focus_on_click=True,
             key_bindings=self._get_kb(),
             include_default_input_processors=False,
             input_processors=[
-                BeforeInput("Search: ", style="bold bg:#3200ff"),
+                BeforeInput(lambda: "Find in files: " if self.in_files else "Search: ", style="bold bg:#3200ff"),
                 # AfterInput("Regex: [ ]", style="bold bg:#3200ff"),
                 ShowLeadingWhiteSpaceProcessor(),
                 ShowTrailingWhiteSpaceProcessor()
@@ -40,46 +52,160 @@ class SearchToolbar(Toolbar):
                 accept_handler=self.handler
             )
         )
+        self.container = HSplit([
+            ConditionalContainer(
+                HSplit([
+                    Window(FormattedTextControl(self._get_results), height=lambda: min(len(self.search.hits) if self.search else 0, self.HEIGHT)),
+                    Window(FormattedTextControl(self._get_status), height=1, style='fg:#888'),
+                ]),
+                filter=Condition(lambda: self.in_files and self.search is not None)),
+            Window(content=self.control, height=1, style='bg:#3200ff'),
+        ])
 
-    def handler(self, buffer: Buffer):
-        regex = re.fullmatch(r'/(.+)/([gi]?)', buffer.text)
+    def __pt_container__(self):
+        return self.container
 
-        found_result = [a for a in self.view.current_view.line_cache.annotations if a['type'] == 'find']
-        if len(found_result) == 0 or self._last_search_str != buffer.text:
+    def handler(self, buffer: Buffer):
+        if self.in_files:
+            return self._find_in_files(buffer.text)
+        if self.view.current_view is None:
+            return True  # <-- keep text
+        view_id = self.view.current_view.view_id
+        if self._last_search_str != buffer.text:
+            regex = re.fullmatch(r'/(.+)/([gi]?)', buffer.text)
             self.view.rpc_channel.edit('find', {
                 'chars': regex.group(1) if regex else buffer.text,
                 'case_sensitive': 'i' not in regex.group(2) if regex else False,
                 'regex': bool(regex),
                 # 'whole_words' : False,
-            }, self.view.view_id)
-            self._find_idx = 0
+            }, view_id)
             self._last_search_str = buffer.text
-            return True  # <-- keep text
+            self._jumped = None
+            # The first hit from the cursor (the hits aren't known here yet):
+            self.view.rpc_channel.edit('find_next', {'wrap_around': True, 'allow_same': True, 'modify_selection': 'set'}, view_id)
+        else:
+            self.jump(forward=True)
+        return True  # <-- keep text
 
-        assert len(found_result) == 1
-        ranges = found_result[0]['ranges']
-        start_line, start_col, end_line, end_col = ranges[self._find_idx % len(ranges)]
-        self._find_idx += 1
+    def jump(self, forward: bool) -> None:
+        """ Select the next (or previous) hit from the cursor """
+        if self._last_search_str is None:  # nothing searched yet
+            return
+        current_view = self.view.current_view
+        cursor = current_view.cursor
+        if self._jumped is not None and self._jumped[0] == cursor:  # Xi hasn't moved the cursor yet
+            cursor = self._jumped[1]
+        hit = None if cursor is None else current_view.find.next(cursor, forward)
+        if hit is None:  # off-screen (or unknown): Xi finds it
+            self._jumped = None
+            self.view.rpc_channel.edit('find_next' if forward else 'find_previous', {
+                'wrap_around': True,
+                'allow_same': False,
+                'modify_selection': 'set',
+            }, current_view.view_id)
+            return
 
-        # Select current found result (start + select_extend to end):
+        start_line, start_col, end_line, end_col = hit
+        self._jumped = (current_view.cursor, (end_line, end_col))
+        # Select the hit (start + select_extend to end):
         self.view.rpc_channel.edit('gesture', {
             'line': start_line,
             'col': start_col,
             'ty': {'select': {'granularity': 'point', 'multi': False}}
-        }, self.view.view_id)
+        }, current_view.view_id)
         self.view.rpc_channel.edit('gesture', {
             'line': end_line,
             'col': end_col,
             'ty': {'select_extend': {'granularity': 'point', 'multi': False}}
-        }, self.view.view_id)
+        }, current_view.view_id)
+
+    def _find_in_files(self, query: str) -> bool:
+        """ Search the files for a new query, else open the selected hit """
+        if self.search is not None and self._files_query == query and self.search.hits:
+            self._open(self.search.hits[self._selected])
+            return False  # <-- delete text
+        if not query:
+            return True  # <-- keep text
+        from ..find_in_files import FindInFiles
+        index = self.view.files_under(self.view.fileman.cwd)
+        if self.search is not None:
+            self.search.cancel()
+        regex = re.fullmatch(r'/(.+)/([gi]?)', query)
+        try:
+            self.search = FindInFiles(
+                index,
+                regex.group(1) if regex else query,
+                regex=bool(regex),
+                case_sensitive='i' not in regex.group(2) if regex else False,
+                on_results=self.view.app.invalidate,
+            )
+        except re.error as e:
+            logging.debug("[SearchToolbar] Invalid regex %r: %s", query, e)
+            self.search = None
+            return True  # <-- keep text
+        self._files_query = query
+        self._selected = 0
         return True  # <-- keep text
 
+    def _open(self, hit) -> None:
+        assert self.search is not None
+        path = os.path.relpath(os.path.join(self.search.index.root, hit.path))
+        logging.debug("[SearchToolbar] Opening %s:%d:%d", path, hit.line + 1, hit.col)
+        self._close()
+        self.view.new_view(path, goto=(hit.line, hit.col))
+
+    def _get_results(self) -> StyleAndTextTuples:
+        assert self.search is not None
+        hits = self.search.hits
+        top = max(0, min(self._selected - self.HEIGHT // 2, len(hits) - self.HEIGHT))  # the selection centered
+        return [
+            ('reverse' if i == self._selected else '', f"{hit.path}:{hit.line + 1}: {hit.text}\n")
+            for (i, hit) in enumerate(hits[top:top + self.HEIGHT], top)
+        ]
+
+    def _get_status(self) -> str:
+        assert self.search is not None
+        return "{hits} hits in {files} files{searching}".format(
+            hits=len(self.search.hits),
+            files=self.search.files_searched,
+            searching='' if self.search.done else ' (searching...)',
+        )
+
+    def _select(self, delta: int) -> None:
+        if self.search is not None:
+            self._selected = max(0, min(len(self.search.hits) - 1, self._selected + delta))
+
+    def _close(self) -> None:
+        if self.search is not None:
+            self.search.cancel()
+        self.view.toolbar = Toolbar(self.view)  # Hide "Find: " and fix focus:
+        if self.view.current_view or self.view.fileman_visible:
+            self.view.app.layout.focus((self.view.current_view or self.view.fileman).input_field)
+
     def _get_kb(self):
         kb = KeyBindings()
 
+        @kb.add('down')
+        def _(event):
+            if self.in_files:
+                self._select(1)
+            else:
+                self.jump(forward=True)
+
+        @kb.add('up')
+        def _(event):
+            if self.in_files:
+                self._select(-1)
+            else:
+                self.jump(forward=False)
+
+        @kb.add('c-f')
+        def _(event):
+            if self.view.current_view is not None:  # (without a view, only the files can be searched)
+                self.in_files = not self.in_files
+
         @kb.add('escape')
         def _(event):
-            self.view.toolbar = Toolbar(self.view)  # Hide "Find: " and fix focus:
-            self.view.app.layout.focus((self.view.current_view or self.view.fileman).input_field)
+            self._close()
 
         return kb
@@ -17,13 +17,12 @@ class Toolbar:
 
     def __pt_container__(self):
         status = ""
-        show_xy = True
-        # Doing: `self.view.global_view.shared_state['settings'].get('show_xy', True)``
-        # Will raise: AttributeError: 'ForkAwareLocal' object has no attribute 'connection'
-        # ?!
+        show_xy = self.view.state.settings.get('show_xy', True)
 
         if current_view := self.view.current_view:
-            status = "{xy} | {file_path} {dirty}".format(
+            status = "{paste}{find}{xy} | {file_path} {dirty}".format(
+                paste=f'Pasting {paste.progress:.0%} (esc: stop) | ' if (paste := current_view.paste) else '',
+                find=f'{current_view.find.summary(current_view.cursor)} | ' if current_view.find.chars is not None else '',
                 xy=f'{current_view.xy}' if show_xy and current_view.xy else '',
                 file_path=current_view.file_path,
                 dirty='*' if current_view.is_dirty else ' ',
@@ -1,12 +1,21 @@
+from __future__ import annotations
 import logging
-import json
-import threading
-import multiprocessing as mp
-from multiprocessing.synchronize import Event as MpEvent
-from time import sleep
+import os
+import shlex
 from typing import Any, Dict, Optional, Union
 from subprocess import Popen, PIPE, DEVNULL
 
+from .codec import get_codec
+from .latency import LATENCY
+from .log import TRACE
+from .state import State
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    import threading
+    from .XiChannel import Result, Sink
+    from multiprocessing.synchronize import Event as MpEvent
+
 #from prompt_toolkit.patch_stdout import patch_stdout
 
 #from enum import Enum, unique
@@ -16,87 +25,170 @@ from subprocess import Popen, PIPE, DEVNULL
 #    SOMETHING = 2
 
 
+XI_CORE = "/tmp/xi-core"
+
+
+def core_command(settings: dict) -> list[str]:
+    """The command starting Xi: `$NUEDIT_XI_CORE`, the `xi_core` setting or XI_CORE
+    (e.g. "python -m nuedit.fake_core --lines 100000" to run without xi-core)"""
+    return shlex.split(os.environ.get('NUEDIT_XI_CORE') or settings.get('xi_core') or XI_CORE)
+
+
 class RpcController:
-    def __init__(self, shared_state: dict, rpc_ready: MpEvent):
-        self.id = 0
-        self.shared_state = shared_state
-        self.backlog: dict[int, mp.Queue] = {}
-        self.core = Popen(["/tmp/xi-core"],
-            stdin=PIPE, stdout=PIPE, stderr=DEVNULL,
-            universal_newlines=True, bufsize=1
-        )
+    def __init__(self, state: State, rpc_ready: Union[threading.Event, MpEvent], core_cmd: Optional[list[str]] = None):
+        self._setup(state)
+        # Pipes are in (buffered) bytes mode, lines are decoded directly by the codec:
+        self.core = Popen(core_cmd or core_command(state.settings), stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
         self.send_raw_dict({"method": "client_started", "params": {}})
         rpc_ready.set()
 
+    def _setup(self, state: State) -> None:
+        self.id = 0
+        self.state = state
+        self.backlog: dict[int, tuple[str, Result]] = {}  # {request id: (method, reply)}
+        # Routing table for view notifications. The channel of the `new_view` reply becomes the
+        # view channel, and notifications arriving before the view_id result are held in `pending`:
+        self.view_channels: dict[str, Sink] = {}
+        self.pending: dict[str, list[tuple[str, dict]]] = {}
+        self.closed: set[str] = set()  # notifications for closed views are dropped (Xi never reuses a view_id)
+        self.codec = get_codec(state.settings.get('json_codec'))
+        TRACE.resize(state.settings.get('rpc_trace_size', 1000))
+
     def kill(self) -> None:
-        stdout, stderr = self.core.communicate('')  # TODO save buffers, etc?
+        stdout, stderr = self.core.communicate(b'')  # TODO save buffers, etc?
         if self.core.returncode != 0:
             logging.warning(f"[RPC] Killing Xi-core with exit code {self.core.returncode}\n{stdout=}\n{stderr=}")
 
-    def request(self, method: str, params: dict, result: Optional[mp.Queue] = None) -> None:
-        """Send {method, params} to Xi. Results of the request will be posted to `result` queue
+    def request(self, method: str, params: dict, result: Optional[Result] = None) -> None:
+        """Send {method, params} to Xi. The result of the request will be put on `result` (see XiChannel.call)
         """
+        self.send_raw_dicts([self._prepare(method, params, result)])
+
+    def request_many(self, requests: list[tuple[str, dict, Optional[Result]]]) -> None:
+        """Send a batch of (method, params, result) requests to Xi (in order) using a single flush"""
+        self.send_raw_dicts([self._prepare(*req) for req in requests])
+
+    def _prepare(self, method: str, params: dict, result: Optional[Result]) -> dict:
         data: dict[str, Any] = {'method': method, 'params': params}
         if result:
             self.id += 1
             data['id'] = self.id
-            self.backlog[self.id] = result
+            self.backlog[self.id] = (method, result)
         else:
             assert result is None, f"Can't get result without request id"
 
-        return self.send_raw_dict(data)
+        if method == 'close_view':
+            self.unregister_view(params['view_id'])
+
+        return data
 
     def send_raw_dict(self, d: dict) -> None:
-        logging.debug(f"[RPC] Sending {json.dumps(d)}")
+        self.send_raw_dicts([d])
+
+    def send_raw_dicts(self, ds: list[dict]) -> None:
+        lines = [self.codec.dumps(d) for d in ds]
+        for line in lines:
+            TRACE.record('>', line)
+            logging.debug("[RPC] Sending %s", line)
+        lines.append(b'')  # trailing newline
+        self._write(b'\n'.join(lines))
+        if edited := [d['params']['view_id'] for d in ds if d.get('method') == 'edit']:
+            LATENCY.sent(edited)
+
+    def _write(self, data: bytes) -> None:
         assert self.core.stdin is not None
-        self.core.stdin.write(json.dumps(d) + "\n")
+        self.core.stdin.write(data)
         self.core.stdin.flush()
 
     def _receive(self) -> dict:
         assert self.core.stdout is not None
         raw = self.core.stdout.readline()
-        logging.debug("[RPC] Receiving: " + (raw or "[none] ")[:-1])
-        return json.loads(raw or '{"todo":"kill_bg_worker"}')
+        if raw:
+            TRACE.record('<', raw)
+        logging.debug("[RPC] Receiving: %s", raw)
+        return self.codec.loads(raw) if raw else {"todo": "kill_bg_worker"}
 
     @staticmethod
     def bg_worker(self) -> None:
-        while True:
-            match self._receive():
-                case {"todo": "kill_bg_worker"}:
-                    return
-
-                case {'error': error}:
-                    logging.error(f'Got err from Xi: {error}')
-
-                # Xi -> General view result
-                case {'id': _id, 'result': result}:
-                    self.backlog[_id].put(result)
-                    del self.backlog[_id]
-
-                # Xi -> RPC (settings, configs, etc)
-                case {'method': method, "params": params} if hasattr(self, f'rpc_{method}'):
-                    getattr(self, f'rpc_{method}')(**params)
+        while (msg := self._receive()) != {"todo": "kill_bg_worker"}:
+            self.handle(msg)
+
+    def handle(self, msg: dict) -> None:
+        """Handle a message from Xi: post results, update the state or route it to a view"""
+        match msg:
+            # Xi -> Error result of a call
+            case {'id': _id, 'error': error}:
+                (method, reply) = self.backlog.pop(_id)
+                logging.error("[RPC] Xi failed %s: %s", method, error)
+                reply.fail(error)
+
+            case {'error': error}:
+                logging.error("Got err from Xi: %s", error)
+
+            # Xi -> General view result
+            case {'id': _id, 'result': result}:
+                (method, reply) = self.backlog.pop(_id)
+                reply.put(result)
+                if method == 'new_view':
+                    assert reply.channel is not None, "new_view is called with the channel of the view"
+                    self.register_view(result, reply.channel)
+
+            # Xi -> RPC (settings, configs, etc)
+            case {'method': method, "params": params} if hasattr(self, f'rpc_{method}'):
+                getattr(self, f'rpc_{method}')(**params)
+
+            # Xi -> View update (with the stamps of the edits it answers, see latency.py)
+            case {'method': 'update', "params": {"view_id": view_id, **update}}:
+                self.route(view_id, ('update', {**update, 'stamps': LATENCY.received(view_id)}))
+
+            # Xi -> View specific settings
+            case {'method': method, "params": {"view_id": view_id, **view_params}}:
+                self.route(view_id, (method, view_params))
+
+            case data:
+                logging.warning("Unhandled message: %s", data)
+
+    def route(self, view_id: str, msg: tuple[str, dict]) -> None:
+        if channel := self.view_channels.get(view_id):
+            channel.put(msg)
+        elif view_id in self.closed:  # e.g. a last update racing `close_view`
+            logging.debug("[RPC] Dropping %s for closed view %s", msg[0], view_id)
+        else:
+            # Xi can notify about a view before the `new_view` result (with the view_id) is received
+            self.pending.setdefault(view_id, []).append(msg)
 
-                # Xi -> View specific settings
-                case {'method': method, "params": {"view_id": view_id, **params}} if view_id in self.shared_state['view_channels']:
-                    self.shared_state['view_channels'][view_id].put((method, params))
-                case {'method': method, "params": {"view_id": view_id, **params}}:
-                    # If the channel hasn't propegated to shared_state, then spawn a thread and wait for it to appear
-                    threading.Thread(target=put_when_ready, args=(self.shared_state, view_id, method, params)).start()
+    def register_view(self, view_id: str, channel: Sink) -> None:
+        """Route notifications for `view_id` to `channel` (and flush any held back notifications)"""
+        assert view_id not in self.view_channels, f"Duplicate view_id: {view_id}"
+        for msg in self.pending.pop(view_id, []):
+            channel.put(msg)
+        self.view_channels[view_id] = channel
 
-                case data:
-                    logging.warning(f"Unhandled message: {data}")
+    def unregister_view(self, view_id: str) -> None:
+        self.view_channels.pop(view_id, None)
+        self.pending.pop(view_id, None)
+        self.closed.add(view_id)
 
     # RPC STUFF BELOW
     def rpc_available_themes(self, themes: list = []):
-        self.shared_state['settings']['available_themes'] = themes
+        self.state.update('settings', {'available_themes': themes})
 
     def rpc_available_languages(self, languages: list = []):
-        self.shared_state['settings']['available_languages'] = languages
-
+        self.state.update('settings', {'available_languages': languages})
+
+    def rpc_def_style(self, id: int, fg_color: Optional[int] = None, bg_color: Optional[int] = None,
+                      weight: Optional[int] = None, italic: bool = False, underline: bool = False, **_):
+        # {"method":"def_style","params":{"id":2,"fg_color":4288256409,"italic":true}}  (colors are ARGB)
+        style = []
+        if fg_color is not None:
+            style.append(f'fg:#{fg_color & 0xffffff:06x}')
+        if bg_color is not None and bg_color >> 24:  # not fully transparent
+            style.append(f'bg:#{bg_color & 0xffffff:06x}')
+        if weight is not None and weight >= 700:
+            style.append('bold')
+        if italic:
+            style.append('italic')
+        if underline:
+            style.append('underline')
+        self.state.update('styles', {id: ' '.join(style)})
 
-def put_when_ready(shared_state, view_id: str, method: str, params: dict):
-    #logging.debug(f"[BG] Unknown view id ({view_id}) not in {self.shared_state['view_channels']}. Spawning put_when_ready")
-    while view_id not in shared_state['view_channels']:
-        sleep(.05)
-    shared_state['view_channels'][view_id].put((method, params))
@@ -0,0 +1,143 @@
+"""Turns the styles, annotations and cursors of a line into (style, text) fragments.
+
+Everything that decorates a line is a span: `(start, end, style)` (end exclusive). Spans
+are layered in the order given (a later span's style is appended to the earlier ones),
+and adjacent characters with the same resulting style are merged into one fragment.
+"""
+from __future__ import annotations
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Iterable, Iterator
+
+from prompt_toolkit.formatted_text import StyleAndTextTuples
+
+Span = tuple[int, int, str]  # (start, end, style)
+END_OF_LINE = 1 << 62  # end of a span that continues on the next line
+
+
+def style_spans(styles: list[int], style_map: dict) -> Iterator[Span]:
+    """Decode Xi's style triplets: [start, length, style_id, ...] where start is relative to the end of the previous span"""
+    last_end = 0
+    for i in range(0, len(styles) - 2, 3):
+        start = last_end + styles[i]
+        last_end = start + styles[i + 1]
+        yield (start, last_end, style_map.get(styles[i + 2], ''))
+
+
+def cursor_spans(cursors: list[int], style: str) -> Iterator[Span]:
+    for cursor in cursors:
+        yield (cursor, cursor + 1, style)
+
+
+def line_fragments(text: str, spans: Iterable[Span]) -> StyleAndTextTuples:
+    """Merge `spans` over `text` into the fewest (style, text) fragments"""
+    newline = text.endswith('\n')
+    body = text[:-1] if newline else text
+    spans = [span for span in spans if span[0] < span[1] and span[0] <= len(body) and span[2]]
+    if not spans:
+        return [('', text)]
+
+    # A cursor after the last character is drawn on an (added) space:
+    if max(span[1] for span in spans) > len(body):
+        body += ' '
+
+    # Sweep over the start/end events of the spans, keeping the (ordered) active spans:
+    n = len(body)
+    events = sorted([(start, i, True) for i, (start, _, _) in enumerate(spans)]
+                    + [(stop if stop < n else n, i, False) for i, (_, stop, _) in enumerate(spans)])
+    active: list[int] = []
+    fragments: StyleAndTextTuples = []
+    style = ''
+    pos = 0
+    for (at, i, opening) in events:
+        if at > pos:
+            if fragments and fragments[-1][0] == style:
+                fragments[-1] = (style, fragments[-1][1] + body[pos:at])
+            else:
+                fragments.append((style, body[pos:at]))
+            pos = at
+        if opening:
+            insort(active, i)
+        else:
+            active.remove(i)
+        style = spans[active[0]][2] if len(active) == 1 else ' '.join([spans[j][2] for j in active])
+    # The unstyled rest of the line (and the newline), merged into the last fragment if it's unstyled too:
+    rest = body[pos:] + ('\n' if newline else '')
+    if rest and fragments and fragments[-1][0] == '':
+        fragments[-1] = ('', fragments[-1][1] + rest)
+    elif rest:
+        fragments.append(('', rest))
+    return fragments
+
+
+class AnnotationIndex:
+    """Maps a (0-indexed) line to the column spans of each AnnotationSet touching it.
+
+    Single line ranges are looked up in a dict, and ranges spanning multiple lines (e.g. after
+    select_all) are found by bisecting their end lines (Xi's ranges are sorted and disjoint)
+    and clipped to the line. So a line only touches its own spans.
+    """
+    def __init__(self, annotations: list = []):
+        # [(type, {line: [(start_col, end_col)]}, [end_line of multiline range], [multiline range])]
+        self._sets: list[tuple[str, dict[int, list[tuple[int, int]]], list[int], list[tuple[int, int, int, int]]]] = []
+        for annotation in annotations:
+            single: dict[int, list[tuple[int, int]]] = {}
+            multi = []
+            for (start_line, start_col, end_line, end_col) in annotation['ranges']:
+                if start_line != end_line:
+                    multi.append((start_line, start_col, end_line, end_col))
+                elif start_col != end_col:  # empty ranges only marks a cursor
+                    single.setdefault(start_line, []).append((start_col, end_col))
+            self._sets.append((annotation['type'], single, [r[2] for r in multi], multi))
+
+    def spans(self, line: int, style_map: dict) -> list[Span]:
+        spans = []
+        for (type, single, end_lines, multi) in self._sets:
+            style = style_map.get(type, '')
+            i = bisect_left(end_lines, line)
+            if i < len(multi) and multi[i][0] < line:  # a range starting above this line
+                (start_line, start_col, end_line, end_col) = multi[i]
+                spans.append((0, end_col if end_line == line else END_OF_LINE, style))
+            spans.extend((start, end, style) for (start, end) in single.get(line, ()))
+            i = bisect_left(end_lines, line + 1, lo=i)
+            if i < len(multi) and multi[i][0] == line:  # a range starting on this line
+                spans.append((multi[i][1], END_OF_LINE, style))
+        return spans
+
+
+class FragmentCache:
+    """LRU cache of rendered lines, keyed by the text and (resolved) spans of the line.
+
+    As the styles are resolved in the key, changing a style, cursor, annotation or the text
+    of a line is a miss, while lines that didn't change (most lines for e.g. a cursor move) are hits.
+    """
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple[str, tuple[Span, ...]], StyleAndTextTuples] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __repr__(self) -> str:
+        return f"FragmentCache(size={len(self)}/{self.maxsize}, hits={self.hits}, misses={self.misses}, hit_rate={self.hit_rate:.2f})"
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / ((self.hits + self.misses) or 1)
+
+    def fragments(self, text: str, spans: list[Span]) -> StyleAndTextTuples:
+        """ Same as `line_fragments(text, spans)` (the result must not be modified) """
+        key = (text, tuple(spans))
+        try:
+            fragments = self._cache[key]
+        except KeyError:
+            self.misses += 1
+            fragments = self._cache[key] = line_fragments(text, spans)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        return fragments
@@ -0,0 +1,45 @@
+from __future__ import annotations
+import logging
+from typing import Any, Optional
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .XiChannel import Channel, Sink
+
+
+# maps strings (e.g "find") but also "style id" (e.g. 0) to a style (e.g. "bg:black")
+DEFAULT_STYLES: dict[str|int, str] = {
+    'cursor': 'reverse underline',
+    'selection': 'reverse',           0: 'reverse',
+    'find': 'fg:ansiyellow bg:black', 1: 'fg:ansiyellow bg:black',
+}
+
+
+class State:
+    """Process local replica of the read-mostly state (settings and styles).
+
+    Reads are plain dict lookups (no round-trip to a manager process). Changes made
+    with `update()` are applied locally and pushed to `outbox`, where the replica in
+    the other process picks them up with `follow()`.
+    """
+    SECTIONS = ('settings', 'styles')
+
+    def __init__(self, settings: dict[str, Any], styles: dict[str|int, str], outbox: Optional[Sink] = None):
+        self.settings = settings
+        self.styles = styles
+        self.outbox = outbox
+
+    def update(self, section: str, changes: dict) -> None:
+        self.apply(section, changes)
+        if self.outbox is not None:
+            self.outbox.put((section, changes))
+
+    def apply(self, section: str, changes: dict) -> None:
+        assert section in State.SECTIONS, f"Unknown state section: {section}"
+        getattr(self, section).update(changes)
+
+    def follow(self, inbox: Channel) -> None:
+        """Apply changes pushed by another replica until `None` is received (blocking)"""
+        while (change := inbox.get()) is not None:
+            logging.debug("[State] Applying %s", change)
+            self.apply(*change)
@@ -1,82 +1,204 @@
 from __future__ import annotations
+import asyncio
 import logging
 from operator import length_hint
+import os
+from pathlib import Path
 import threading
-import multiprocessing as mp
 from collections import OrderedDict
-from time import time, sleep
-from typing import Any, Dict, List, Optional
+from concurrent.futures import CancelledError, Future, TimeoutError as FutureTimeoutError
+from functools import partial
+from queue import Empty
+from time import monotonic, time, sleep
+from typing import Any, Callable, Dict, List, Optional
 
 from prompt_toolkit import Application
 from prompt_toolkit.clipboard import InMemoryClipboard
-from prompt_toolkit.formatted_text import FormattedText  #, HTML('<u>underline</u>')
-from prompt_toolkit.layout.controls import FormattedTextControl
+from prompt_toolkit.formatted_text import StyleAndTextTuples  #, HTML('<u>underline</u>')
+from prompt_toolkit.layout.controls import FormattedTextControl, UIContent
 from prompt_toolkit.layout.containers import DynamicContainer, Container, Window, HSplit, VSplit
 from prompt_toolkit.layout.layout import Layout
+from prompt_toolkit.mouse_events import MouseEvent
 from prompt_toolkit.output.color_depth import ColorDepth
 from prompt_toolkit.widgets import HorizontalLine, VerticalLine
 from prompt_toolkit.widgets.base import Border
 
-from .XiChannel import XiChannel
+from .XiChannel import Channel, Sink, XiChannel, XiError
+from .aio import AsyncViewChannel
+from .coalesce import CoalescingChannel
+from .find import FindIndex
+from .state import State
+from .line import mouse_handler
 from .line_cache import LineCache
 from .keybinding import get_view_kb
-from .filemanager import Filemanager
-from .menu import Toolbar
+from .latency import LATENCY
+from .log import STARTUP
+from .menu.toolbar import Toolbar
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from .actions.copypaste import StreamingPaste
+    from .file_index import FileIndex
+    from .filemanager import Filemanager
+
+NEW_VIEW_TIMEOUT = 30.0  # seconds to wait for Xi to open a file (it reads the whole file first)
+
+
+class ViewControl(FormattedTextControl):
+    """Renders the visible lines of a `SimpleView` and tells the view its height"""
+    def __init__(self, sview: SimpleView):
+        super().__init__(text=lambda: sview.fragments, show_cursor=False)
+        self.sview = sview
+
+    def create_content(self, width: int, height: Optional[int]) -> UIContent:
+        if height is not None:  # None when asked for preferred height
+            self.sview.resize(height)  # (if it changed: sends Xi the scroll region and queues a redraw for the view thread)
+        return super().create_content(width, height)
+
+    def mouse_handler(self, mouse_event: MouseEvent) -> None:
+        (col, row) = mouse_event.position
+        mouse_handler(self.sview, (col, self.sview.scroll_top + row), mouse_event)
 
 
 class SimpleView:
-    def __init__(self, file_path: Optional[str], channel: XiChannel, view_id: str, global_view: GlobalView):
+    SCROLL_LINES = 3  # lines per mouse wheel step
+
+
+    def __init__(self, file_path: Optional[str], channel: Sink, view_id: str, global_view: GlobalView):
         self.file_path = file_path
         self.view_id = view_id
         self.global_view = global_view
+        self.channel = channel
         self._debug_update_timer = time()
 
         self.config: dict[str, Any] = {}  # font size, word wrap, line ending, etc
         self.undo_stack = [('close_view', {'view_id': view_id})]
         self.is_dirty: Optional[bool] = None
+        self.paste: Optional[StreamingPaste] = None  # a large paste in progress (key presses are ignored meanwhile)
+        self.find = FindIndex()
 
         self.line_cache = LineCache(global_view)
-        self.input_field = Window(
-            content=FormattedTextControl(
-                key_bindings=get_view_kb(self.global_view),
-                show_cursor=False,
-                text="LOADING...",
-            )
-        )
+        # Viewport: only lines [scroll_top, scroll_top + height) are requested from Xi and rendered
+        self.scroll_top = 0
+        self.height = 0
+        self.fragments: StyleAndTextTuples = [('', 'LOADING...')]
+        self.input_field = Window(content=ViewControl(self))
+        # Updates are applied as they arrive, but drawn at most once per frame:
+        self.max_fps = global_view.state.settings.get('max_fps', 60)
+        self.needs_render = False
+        self.updates_applied = 0
+        self.frames_rendered = 0
 
         self.xy: Optional[tuple[int, int]] = None
-        self.lineNo = Window(width=2, content=FormattedTextControl(text="  "))
+        self._gutter: tuple[tuple[int, int, int], str] = ((-1, -1, -1), "")  # ((scroll_top, height, line_cache.version), line numbers)
+        self.lineNo = Window(width=1, content=FormattedTextControl(text=self._get_gutter))
         self.container = VSplit([self.lineNo, VerticalLine(), self.input_field])
 
-        # Start _bg_worker (listen for msgs on shared_state['view_channels'][this-view-id] and apply them to self):
-        self.thread = threading.Thread(target=self._bg_worker, args=(channel, ))
-        self.thread.start()
-
-        # Notify Xi about terminal size:
-        #def _resizeHandler(signum, frame):
-        #    proc = os.popen('stty size', 'r')
-        #    rows, columns = proc.read().split()
-        #    self.rpc_channel.edit('scroll', {int(columns), int(rows)}, self.view_id)
-        #    #        'width': int(columns),  # <-- TODO: in pixels
-        #    #        'height': int(rows)     # .input_field.width, ?
-        #    logging.debug("[RESIZE] {} {} | w/h:{}/{}".format(signum, frame, columns, rows))
-        #    proc.close()
-        #signal.signal(signal.SIGWINCH, _resizeHandler)
-        #_resizeHandler(None, None)
+        self.thread: Optional[threading.Thread] = None
+        if isinstance(channel, AsyncViewChannel):
+            channel.attach(self)  # msgs are dispatched on the event loop
+        else:
+            # Start _bg_worker (listen for msgs on the view channel and apply them to self):
+            self.thread = threading.Thread(target=self._bg_worker, args=(channel, ))
+            self.thread.start()
 
     def __pt_container__(self) -> Container:
         return self.container
 
     def _bg_worker(self, channel):
+        frame_time = 1 / self.max_fps
+        next_frame = 0.0
         while True:
-            (method, params) = channel.get()
-            logging.debug(f"[SimpleView] _bg_worker: {method=} {params=}")
-            if method == 'kill':
-                break
-            elif hasattr(self, f'rpc_{method}'):
-                getattr(self, f'rpc_{method}')(**params)
+            try:
+                # Block until a msg arrives, or until the next frame is due if there is something to draw:
+                (method, params) = channel.get(timeout=max(0.0, next_frame - monotonic()) if self.needs_render else None)
+            except Empty:
+                pass
             else:
-                logging.warning(f"[SimpleView] Unknown method: {method}")
+                if method == 'kill':
+                    break
+                self.dispatch(method, params)
+                # Apply everything already queued before drawing (but don't starve the drawing):
+                if not channel.empty() and monotonic() < next_frame + frame_time:
+                    continue
+            if self.needs_render and monotonic() >= next_frame:
+                self.draw_frame()
+                next_frame = monotonic() + frame_time
+
+    def dispatch(self, method: str, params: dict) -> None:
+        logging.debug("[SimpleView] dispatch: method=%s params=%s", method, params)
+        if hasattr(self, f'rpc_{method}'):
+            getattr(self, f'rpc_{method}')(**params)
+        else:
+            logging.warning("[SimpleView] Unknown method: %s", method)
+
+    def draw_frame(self) -> None:
+        self.needs_render = False
+        self.render()
+        LATENCY.rendered(self.view_id)
+        self.frames_rendered += 1
+        self.global_view.app.invalidate()  # <-- redraw content
+        logging.debug("[SimpleView] Frame %d (%d updates applied)", self.frames_rendered, self.updates_applied)
+
+    def resize(self, height: int) -> None:
+        """Called on every render with the height of the window"""
+        if height != self.height:
+            self.height = height
+            self._send_scroll()
+            self._redraw()
+
+    def scroll_by(self, n: int) -> None:
+        self.scroll_to(self.scroll_top + n)
+
+    def scroll_to(self, top: int) -> None:
+        top = max(0, min(top, len(self.line_cache) - 1))
+        if top != self.scroll_top:
+            self.scroll_top = top
+            self._send_scroll()
+            self._redraw()
+
+    def _redraw(self) -> None:
+        """Draw the next frame from the thread applying the updates: rendering on the UI thread (e.g. while
+        painting) could read the LineCache in the middle of an update"""
+        self.channel.put(('redraw', {}))
+
+    def _send_scroll(self) -> None:
+        # Tell Xi the visible region, [first, last) line:
+        self.global_view.rpc_channel.edit('scroll', [self.scroll_top, self.scroll_top + self.height], self.view_id)
+
+    def _get_gutter(self) -> str:
+        return self._gutter[1]
+
+    def _render_gutter(self, len_of_lineno_col: int) -> None:
+        """Line numbers of the visible lines (only rebuilt when scrolled or updated)"""
+        key = (self.scroll_top, self.height, self.line_cache.version)
+        if self._gutter[0] != key:
+            self._gutter = (key, '\n'.join(
+                str(l.ln).rjust(len_of_lineno_col, ' ') if l else '?'*len_of_lineno_col
+                for l in self.line_cache.visible(self.scroll_top, self.scroll_top + self.height)
+            ))
+
+    def render(self) -> None:
+        """Build the fragments (and line numbers) for the visible lines, on the thread applying the updates"""
+        len_of_lineno_col = len(str(self.line_cache.max_ln))
+        if len_of_lineno_col != self.lineNo.width:
+            self.lineNo.width = len_of_lineno_col
+            self._gutter = ((-1, -1, -1), self._gutter[1])
+        self._render_gutter(len_of_lineno_col)
+
+        # https://python-prompt-toolkit.readthedocs.io/en/master/pages/printing_text.html#style-text-tuples
+        output: StyleAndTextTuples = []
+        for line in self.line_cache.visible(self.scroll_top, self.scroll_top + self.height):
+            if line:
+                output.extend(self.line_cache.render(line))
+            else:
+                output.append(('', '\n'))
+        self.fragments = output
+        logging.debug("[SimpleView] Rendered lines %d-%d (%s)", self.scroll_top, self.scroll_top + self.height, self.line_cache.fragment_cache)
+
+    def rpc_redraw(self):
+        # Not from Xi, queued by `_redraw`
+        self.needs_render = True
 
     # Commands from Xi below
     def rpc_language_changed(self, language_id: str):
@@ -90,60 +212,56 @@ class SimpleView:
         # {'changes': {'auto_indent': True, 'autodetect_whitespace': True, 'font_face': 'InconsolataGo', 'font_size': 14, 'line_ending': '\n', 'plugin_search_path': [], 'save_with_newline': True, 'scroll_past_end': False, 'surrounding_pairs': [['"', '"'], ["'", "'"], ['{', '}'], ['[', ']']], 'tab_size': 4, 'translate_tabs_to_spaces': True, 'use_tab_stops': True, 'word_wrap': False, 'wrap_width': 0}}
         self.config.update(changes)
 
-    def rpc_update(self, update: dict):
+    def rpc_update(self, update: dict, stamps: Optional[tuple] = None):
         self._debug_update_timer = time()
+        if self.is_dirty is None:
+            STARTUP.mark(f"{self.file_path or 'new file'} loaded")
         self.is_dirty = not update['pristine']
         self.line_cache.apply_update(update)
-
-        len_of_lineno_col = len(str(self.line_cache.max_ln))
-        self.lineNo.content = FormattedTextControl(text='\n'.join(
-            str(l.ln).rjust(len_of_lineno_col, ' ') if l else '?'*len_of_lineno_col
-            for l in self.line_cache.lines
-        ))
-        self.lineNo.width = len_of_lineno_col
-
-        # Redraw
-        # https://python-prompt-toolkit.readthedocs.io/en/master/pages/printing_text.html#style-text-tuples
-        output = []
-        for line in self.line_cache.lines:
-            if line:
-                for style_text_pair in line.get_style_text_pairs(self.line_cache.annotations):
-                    # logging.debug(f'[SimpleView] {style_text_pair=}')
-                    output.append(style_text_pair)
-            else:
-                output.append(('', '\n'))
-        self.input_field.content = FormattedTextControl(
-            show_cursor=False,
-            text=FormattedText(output)
-        )
-
-        self.global_view.app.invalidate()  # <-- redraw content
-        logging.debug("[SimpleView] Update + redraw took {:.5f}s".format(time() - self._debug_update_timer))
+        self.find.set_ranges(self.line_cache.annotations)
+        LATENCY.applied(self.view_id, stamps)  # type: ignore
+        self.updates_applied += 1
+        self.needs_render = True  # drawn by _bg_worker once the burst of updates is applied
+        logging.debug("[SimpleView] Update took %.5fs", time() - self._debug_update_timer)
 
     def rpc_scroll_to(self, col: int, line: int):
         # "frontend should scroll its cursor to the given line and column."
         self.xy = (col, line)
+        if line < self.scroll_top:
+            self.scroll_to(line)
+        elif self.height and line >= self.scroll_top + self.height:
+            self.scroll_to(line - self.height + 1)
 
     def rpc_find_status(self, queries: list):
-        pass  # for query in queries:
+        # {"queries": [{"id": 1, "chars": "a", "case_sensitive": false, "is_regex": false, "whole_words": false, "matches": 6, "lines": [1, 3, 3, 6]}]}
+        self.find.set_status(queries)
+        self.global_view.app.invalidate()  # the toolbar shows the number of hits
+
+    @property
+    def cursor(self) -> Optional[tuple[int, int]]:
+        """ (line, col) of the cursor, as last scrolled to by Xi """
+        return None if self.xy is None else (self.xy[1], self.xy[0])
 
 
 class GlobalView:
-    def __init__(self, manager: mp.managers.SyncManager, shared_state: dict, rpc_channel: XiChannel):
-        self.manager = manager
-        self.shared_state = shared_state
+    def __init__(self, new_queue: Optional[Callable[[], Channel]], state: State, rpc_channel: CoalescingChannel):
+        self.new_queue = new_queue  # creates queues shared with the backend (None with the asyncio transport)
+        self.state = state
         self.rpc_channel = rpc_channel
+        self.focused_view: Optional[str] = None  # only lives in the frontend
 
-        self.fileman = Filemanager(self)
+        self._fileman: Optional[Filemanager] = None  # created when first shown
+        self._file_indexes: dict[Path, FileIndex] = {}  # {root: index}, created on the first quick-open (or find in files)
         self.fileman_visible = True
 
         self.toolbar = Toolbar(self)
+        self.clipboard_future: Optional[Future] = None  # the text of the last copy/cut (see actions/copypaste.py)
 
         self.views: dict[str, SimpleView] = OrderedDict()
 
         self.app: Application = Application(
             full_screen=True,
-            mouse_support=shared_state['settings'].get('mouse_support', False),
+            mouse_support=state.settings.get('mouse_support', False),
             color_depth=ColorDepth.DEPTH_24_BIT,
             clipboard=InMemoryClipboard(),
             enable_page_navigation_bindings=False,
@@ -157,6 +275,27 @@ class GlobalView:
                 # focused_element=(self.current_view or self.fileman).input_field,
             ),
         )
+        self.app.after_render += LATENCY.painted
+
+    @property
+    def fileman(self) -> Filemanager:
+        if self._fileman is None:
+            from .filemanager import Filemanager
+            self._fileman = Filemanager(self)
+        return self._fileman
+
+    @property
+    def file_index(self) -> FileIndex:
+        """ The files of the project (the working directory), for quick-open """
+        return self.files_under(Path.cwd())
+
+    def files_under(self, root: Path) -> FileIndex:
+        """ The index of the files under `root` (crawled once, on first use) """
+        root = root.resolve()
+        if root not in self._file_indexes:
+            from .file_index import FileIndex
+            self._file_indexes[root] = FileIndex(root, on_update=self.app.invalidate)
+        return self._file_indexes[root]
 
     def _get_children(self):
         children = ([self.fileman] if self.fileman_visible else []) \
@@ -170,11 +309,11 @@ class GlobalView:
 
     @property
     def current_view(self) -> Optional[SimpleView]:
-        return self.views.get(self.shared_state['focused_view'])
+        return self.views.get(self.focused_view)  # type: ignore
 
     def set_focus(self, view_id: str) -> None:
         logging.debug(f"[View] set_focus({view_id=})")
-        self.shared_state['focused_view'] = view_id
+        self.focused_view = view_id
         # When creating a new_view then set_focus will be called immediately after
         # This will create a race-condition between app.focus("LOADING...") and the
         # "LOADING..." component being replaced by the actually content (SimpleView
@@ -184,8 +323,8 @@ class GlobalView:
 
     def _set_focus(self, view_id: str) -> None:
         # Break if multiple threads are competing for focus:
-        logging.debug(f"[View] _set_focus({view_id=}) should eq {self.shared_state['focused_view']}")
-        while self.shared_state['focused_view'] == view_id:
+        logging.debug(f"[View] _set_focus({view_id=}) should eq {self.focused_view}")
+        while self.focused_view == view_id:
             if current_view := self.current_view:
                 if current_view.is_dirty is None:
                     sleep(.1)
@@ -195,24 +334,89 @@ class GlobalView:
                     break
             logging.debug(f"[View] _set_focus({view_id=}) waiting for {current_view=} (is_dirty)")
 
-    def new_view(self, file_path: Optional[str] = None):
-        channel = self.manager.Queue()
-        self.rpc_channel.put('new_view', {} if file_path is None else {'file_path': file_path}, result=channel)
-        # Wait for 'view-id-X' identifier:
-        view_id = channel.get()
-        assert view_id not in self.shared_state['view_channels'], f"Duplicate view_id: {view_id} ({self.shared_state})"
-        self.shared_state['view_channels'][view_id] = channel
+    def new_view(self, file_path: Optional[str] = None, goto: Optional[tuple[int, int]] = None):
+        """Open `file_path` (focus it if it's already open), with the cursor at `goto` (line, col) if given"""
+        if file_path is not None:
+            for view in self.views.values():
+                if view.file_path is not None and os.path.realpath(view.file_path) == os.path.realpath(file_path):
+                    self.set_focus(view.view_id)
+                    if goto is not None:
+                        self._goto(view.view_id, goto)
+                    return
+        self.new_views([file_path], goto)
+
+    def new_views(self, file_paths: list[Optional[str]], goto: Optional[tuple[int, int]] = None) -> None:
+        """Open the files concurrently (all `new_view` requests are sent before any view_id arrives)"""
+        opening = []
+        for file_path in file_paths:
+            # The backend routes all notifications for the new view to `channel`:
+            channel: Sink = AsyncViewChannel() if self.new_queue is None else self.new_queue()
+            params = {} if file_path is None else {'file_path': file_path}
+            opening.append((file_path, channel, self.rpc_channel.call('new_view', params, channel=channel)))
+        for (file_path, channel, view_id) in opening:
+            self.when_done(view_id, partial(self._add_view, file_path, channel, goto=goto), timeout=NEW_VIEW_TIMEOUT)
+
+    def when_done(self, future: Future, callback: Callable[[Any], None], timeout: Optional[float] = None,
+                  cancelled: Optional[Callable[[], None]] = None) -> None:
+        """Call `callback(result)` on the event loop once `future` (see XiChannel.call) is resolved, or `cancelled()`
+        if the call fails or is cancelled (e.g. after `timeout` seconds). Before the UI runs (no event loop yet) this waits for it.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            try:
+                result = future.result(timeout)
+            except (FutureTimeoutError, CancelledError, XiError) as e:
+                if isinstance(e, FutureTimeoutError):
+                    future.cancel()
+                    logging.warning("[View] Xi didn't answer in %ss", timeout)
+                if cancelled is not None:
+                    cancelled()
+                return
+            callback(result)
+            return
+
+        def done(future: Future) -> None:
+            if not future.cancelled() and future.exception() is None:
+                loop.call_soon_threadsafe(callback, future.result())
+            elif cancelled is not None:
+                loop.call_soon_threadsafe(cancelled)
+        future.add_done_callback(done)
+        if timeout is not None:
+            loop.call_later(timeout, self._expire, future, timeout)
+
+    @staticmethod
+    def _expire(future: Future, timeout: float) -> None:
+        if future.cancel():
+            logging.warning("[View] Xi didn't answer in %ss, dropping the call", timeout)
+
+    def _add_view(self, file_path: Optional[str], channel, view_id: str, goto: Optional[tuple[int, int]] = None) -> None:
+        assert view_id not in self.views, f"Duplicate view_id: {view_id} ({self.views})"
         self.views[view_id] = SimpleView(file_path, channel, view_id, self)
         self.set_focus(view_id)
+        if goto is not None:
+            self._goto(view_id, goto)
+
+    def _goto(self, view_id: str, goto: tuple[int, int]) -> None:
+        """ Move the cursor of the view to (line, col), Xi scrolls to it """
+        (line, col) = goto
+        self.rpc_channel.edit('gesture', {
+            'line': line,
+            'col': col,
+            'ty': {'select': {'granularity': 'point', 'multi': False}}
+        }, view_id)
 
     def close_view(self, view_id: str):
+        if paste := self.views[view_id].paste:
+            paste.cancel()
         self.rpc_channel.put('close_view', {'view_id': view_id})
-        self.shared_state['view_channels'][view_id].put(('kill', {}))
-        self.views[view_id].thread.join()
-        del self.shared_state['view_channels'][view_id]
+        self.views[view_id].channel.put(('kill', {}))
+        if thread := self.views[view_id].thread:
+            thread.join()
         del self.views[view_id]
-        if view_id == self.shared_state['focused_view']:
-            self.shared_state['focused_view'] = None
+        LATENCY.forget(view_id)
+        if view_id == self.focused_view:
+            self.focused_view = None
             try:
                 new_focused_view = list(self.views)[0]
                 self.set_focus(new_focused_view)
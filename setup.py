@@ -59,6 +59,9 @@ setup(
     python_requires='>=3.10',  # 3.8 b/c walrus operator and 3.10 b/c match-case
     url='https://xn--sb-lka.org/NicolaiSoeborg/NuEdit/',
     py_modules=['nuedit'],
+    extras_require={
+        'fast': ['orjson'],  # faster JSON codec for the Xi transport (msgspec also works)
+    },
     # entry_points={
     #     'console_scripts': ['mycli=mymodule:cli'],
     # },